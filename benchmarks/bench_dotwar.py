@@ -0,0 +1,239 @@
+# benchmark suite for the simulation, collisions, persistence and HTTP routes.
+# generates a synthetic game of the requested size, times each operation, and writes the results as JSON.
+#
+# usage: python benchmarks/bench_dotwar.py [--entities 200] [--orders 2] [--events 5000] [--output results.json]
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.parse
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+import numpy as np
+
+import dotwar_classes
+
+GAME_NAME = "BENCH"
+
+
+def generate_game(directory, entities, orders, events, engine="loop", seed=0):
+	# entities: vessels around one planet, alternating teams. orders: pending burns per vessel, spread over a day.
+	# events: synthetic burn events already in the log.
+	rng = random.Random(seed)
+	with contextlib.redirect_stdout(io.StringIO()):
+		game = dotwar_classes.Game(GAME_NAME, directory, force_new=True, load=False, engine=engine)
+		game.new(overwrite=True)
+		game.load()
+		start = game.get_system_time()
+
+		game.add_entity("Earth", None, [0, 0, 0], [0, 0, 0], [0, 0, 0], "planet", [], dotwar_classes.team.SELF)
+		game.edit_entity("Earth", "captured", False)
+		for i in range(entities):
+			name = f"VESSEL{i}"
+			game.add_entity(name, "BENCH",
+							[rng.uniform(-1e9, 1e9) for _ in range(3)],
+							[rng.uniform(-1e7, 1e7) for _ in range(3)],
+							[0, 0, 0],
+							"craft", [], i % 2, new_authcode=True)
+			vessel = game.get_entity(name)
+			for _ in range(orders):
+				vessel.add_order("burn", {"a": [rng.uniform(-1e5, 1e5) for _ in range(3)]},
+								start + datetime.timedelta(seconds=rng.uniform(0, 86400)))
+
+		for i in range(events):
+			game.add_event({"type": "burn",
+							"args": {"vessel": f"VESSEL{i % max(entities, 1)}", "a": [0.0, 0.0, 0.0],
+									"kinematics": {"r": [0.0, 0.0, 0.0], "v": [0.0, 0.0, 0.0], "a": [0.0, 0.0, 0.0]}},
+							"time": (start - datetime.timedelta(seconds=events - i)).isoformat()})
+		game.save()
+	return game
+
+
+def measure(function, repeat, setup=None):
+	# run function `repeat` times (after setup() each time, untimed) with library output silenced
+	timings = []
+	with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+		for _ in range(repeat):
+			argument = setup() if setup else None
+			start = time.perf_counter()
+			function(argument) if setup else function()
+			timings.append(time.perf_counter() - start)
+	return {"min": min(timings), "median": statistics.median(timings), "mean": statistics.fmean(timings),
+			"max": max(timings), "repeat": repeat}
+
+
+def wsgi_call(application, path, params=None):
+	# one in-process POST through the WSGI app, returns (status, body)
+	body = urllib.parse.urlencode(params or {}).encode()
+	environ = {
+		"REQUEST_METHOD": "POST",
+		"PATH_INFO": path,
+		"QUERY_STRING": "",
+		"CONTENT_TYPE": "application/x-www-form-urlencoded",
+		"CONTENT_LENGTH": str(len(body)),
+		"SERVER_NAME": "localhost",
+		"SERVER_PORT": "80",
+		"SERVER_PROTOCOL": "HTTP/1.1",
+		"wsgi.input": io.BytesIO(body),
+		"wsgi.errors": sys.stderr,
+		"wsgi.url_scheme": "http",
+		"wsgi.version": (1, 0),
+		"wsgi.multithread": False,
+		"wsgi.multiprocess": False,
+		"wsgi.run_once": False,
+	}
+	response = {}
+
+	def start_response(status, headers, exc_info=None):
+		response["status"] = status
+
+	chunks = application(environ, start_response)
+	body = b"".join(chunk if isinstance(chunk, bytes) else chunk.encode() for chunk in chunks)
+	if hasattr(chunks, "close"):
+		chunks.close()
+	return response["status"], body
+
+
+def bench_simulation(directory, args, results):
+	def fresh_game(engine):
+		return lambda: dotwar_classes.Game(GAME_NAME, directory, engine=engine)
+
+	for engine in args.engines:
+		for seconds in args.intervals:
+			interval = datetime.timedelta(seconds=seconds)
+			results.append({"name": "Game.update", "params": {"engine": engine, "interval_seconds": seconds},
+							"seconds": measure(lambda game: game.update(interval), args.repeat, setup=fresh_game(engine))})
+
+	game = dotwar_classes.Game(GAME_NAME, directory)
+	results.append({"name": "Game.test_collisions", "params": {},
+					"seconds": measure(game.test_collisions, args.repeat)})
+
+
+def bench_persistence(directory, args, results):
+	game = dotwar_classes.Game(GAME_NAME, directory)
+	results.append({"name": "Game.system_as_json", "params": {},
+					"seconds": measure(game.system_as_json, args.repeat)})
+
+	def dirty_game():
+		game.mark_dirty()
+		return game
+	for storage in dotwar_classes.Game.STORAGES:
+		game.set_storage(storage)
+		results.append({"name": "Game.save", "params": {"storage": storage},
+						"seconds": measure(lambda g: g.save(), args.repeat, setup=dirty_game)})
+		results.append({"name": "Game.load", "params": {"storage": storage},
+						"seconds": measure(lambda: dotwar_classes.Game(GAME_NAME, directory), args.repeat)})
+
+
+def bench_routes(directory, args, results):
+	with contextlib.redirect_stdout(io.StringIO()):
+		import dotwar_server
+	dotwar_server.global_config["game_dir"] = directory
+	dotwar_server.GAMES.game_dir = directory
+	dotwar_server.GAMES.engine = args.engines[0]
+	application = dotwar_server.application
+
+	vessel = dotwar_classes.Game(GAME_NAME, directory).get_entity("VESSEL0")
+	vessel_params = {"vessel": vessel.name, "authcode": vessel.authcode}
+	order = json.dumps({"task": "burn", "args": {"a": [1.0, 0.0, 0.0]}, "time": 3600, "interval": True})
+
+	routes = [
+		("/games", {}),
+		(f"/game/{GAME_NAME}/status", {}),
+		(f"/game/{GAME_NAME}/scan", {}),
+		(f"/game/{GAME_NAME}/summary", {}),
+		(f"/game/{GAME_NAME}/agenda", vessel_params),
+		(f"/game/{GAME_NAME}/add_order", dict(vessel_params, order=order)),
+	]
+	# the first request loads the game and catches it up; time that separately from warm requests
+	results.append({"name": "route", "params": {"path": routes[1][0], "cold": True},
+					"seconds": measure(lambda: wsgi_call(application, routes[1][0]), 1)})
+	for path, params in routes:
+		results.append({"name": "route", "params": {"path": path, "cold": False},
+						"seconds": measure(lambda: wsgi_call(application, path, params), args.repeat)})
+	# final save now, while the game directory still exists
+	dotwar_server.FLUSHER.stop()
+
+
+def git_revision():
+	try:
+		return subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO_DIR, capture_output=True, text=True,
+							check=True).stdout.strip()
+	except (OSError, subprocess.CalledProcessError):
+		return None
+
+
+def main():
+	parser = argparse.ArgumentParser(description="Benchmark dotwar simulation, persistence and routes.")
+	parser.add_argument("--entities", type=int, default=200, help="number of vessels")
+	parser.add_argument("--orders", type=int, default=2, help="pending orders per vessel")
+	parser.add_argument("--events", type=int, default=5000, help="events already in the log")
+	parser.add_argument("--engines", nargs="+", default=list(dotwar_classes.Game.ENGINES),
+						choices=dotwar_classes.Game.ENGINES)
+	parser.add_argument("--intervals", nargs="+", type=float, default=[60, 3600, 86400],
+						help="simulated seconds per Game.update run")
+	parser.add_argument("--repeat", type=int, default=3)
+	parser.add_argument("--suites", nargs="+", default=["simulation", "persistence", "routes"],
+						choices=["simulation", "persistence", "routes"])
+	parser.add_argument("--seed", type=int, default=0)
+	parser.add_argument("--output", help="write results here instead of stdout")
+	args = parser.parse_args()
+
+	directory = tempfile.mkdtemp(prefix="dotwar-bench-")
+	results = []
+	try:
+		generate_game(directory, args.entities, args.orders, args.events, seed=args.seed)
+		template = os.path.join(directory, "template")
+		os.mkdir(template)
+		for filename in os.listdir(directory):
+			if filename.startswith("system."):
+				shutil.copy(os.path.join(directory, filename), template)
+
+		suites = {"simulation": bench_simulation, "persistence": bench_persistence, "routes": bench_routes}
+		for suite in args.suites:
+			# every suite starts from the same generated game, in its original save format
+			for filename in os.listdir(directory):
+				if filename.startswith("system."):
+					os.remove(os.path.join(directory, filename))
+			for filename in os.listdir(template):
+				shutil.copy(os.path.join(template, filename), directory)
+			suites[suite](directory, args, results)
+	finally:
+		shutil.rmtree(directory, ignore_errors=True)
+
+	report = {
+		"meta": {
+			"time": datetime.datetime.now().isoformat(),
+			"revision": git_revision(),
+			"python": platform.python_version(),
+			"numpy": np.__version__,
+			"platform": platform.platform(),
+			"entities": args.entities,
+			"orders_per_entity": args.orders,
+			"events": args.events,
+			"seed": args.seed,
+		},
+		"results": results,
+	}
+	if args.output:
+		with open(args.output, "w") as output_file:
+			json.dump(report, output_file, indent=4)
+	else:
+		json.dump(report, sys.stdout, indent=4)
+		print()
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,161 @@
+import datetime
+import json
+import os
+import threading
+
+import numpy as np
+
+import dotwar_metrics
+import dotwar_snapshot
+import dotwar_table
+
+# periodic kinematic checkpoints of a game, so its state at an earlier time can be rebuilt by simulating forward
+# from the nearest checkpoint before then (see Game.rewind) rather than from the start of the game.
+# each checkpoint is a compressed NumPy archive beside the save file:
+#
+#  system.<name>.checkpoint.<system time as TIME_FORMAT>.npz
+#    kinematics  KINEMATICS_DTYPE rows (see dotwar_snapshot), one per entity
+#    team        int8
+#    captured    int8 codes (see dotwar_table)
+#    meta        JSON: system_time, event_id (the last event logged by then, or -1),
+#                and name, captain, type and created_on lists in the same order as the rows
+#
+# checkpoints are taken in memory while the game is simulated and written out when it's saved.
+# only the newest `keep` are kept, on disk and off.
+TIME_FORMAT = "%Y%m%dT%H%M%S%f"
+SUFFIX = ".npz"
+
+
+def filename(name: str, time: datetime.datetime):
+	return f"system.{name}.checkpoint.{time.strftime(TIME_FORMAT)}{SUFFIX}"
+
+
+def checkpoint_files(directory: str, name: str):
+	# (time, file name) of every checkpoint of the game on disk, oldest first
+	prefix = f"system.{name}.checkpoint."
+	files = []
+	for file in os.listdir(directory):
+		if file.startswith(prefix) and file.endswith(SUFFIX):
+			try:
+				files.append((datetime.datetime.strptime(file[len(prefix):-len(SUFFIX)], TIME_FORMAT), file))
+			except ValueError:
+				continue
+	return sorted(files)
+
+
+class Checkpoint:
+	def __init__(self, time: datetime.datetime, event_id: int, columns: dict, kinematics, team, captured):
+		self.time = time
+		self.event_id = event_id
+		self.columns = columns  # name, captain, type, created_on: one list entry per row
+		self.kinematics = kinematics
+		self.team = team
+		self.captured = captured
+
+	@classmethod
+	def of(cls, game):
+		# the game's entities as they are now, gathered from its EntityTable in one go
+		entities = list(game.system["entities"].values())
+		rows = [entity.row for entity in entities]
+		table = game.table
+		kinematics = np.empty(len(rows), dtype=dotwar_snapshot.KINEMATICS_DTYPE)
+		kinematics["r"], kinematics["v"], kinematics["a"] = table.r[rows], table.v[rows], table.a[rows]
+		columns = {
+			"name": [entity.name for entity in entities],
+			"captain": [entity.captain for entity in entities],
+			"type": [table.kinds[code] for code in table.kind[rows].tolist()],
+			"created_on": [entity.created_on.isoformat() for entity in entities],
+		}
+		return cls(game.get_system_time(), game.last_event_id(), columns, kinematics,
+				table.team[rows].copy(), table.captured[rows].copy())
+
+	@classmethod
+	def read(cls, path: str):
+		with np.load(path) as archive:
+			meta = json.loads(str(archive["meta"]))
+			kinematics, team, captured = archive["kinematics"], archive["team"], archive["captured"]
+		return cls(datetime.datetime.fromisoformat(meta.pop("system_time")), meta.pop("event_id"), meta,
+				kinematics, team, captured)
+
+	def write(self, path: str, mode=0o644):
+		meta = dict(self.columns, system_time=self.time.isoformat(), event_id=self.event_id)
+		temp_path = path + ".tmp"
+		try:
+			with open(temp_path, "wb") as checkpoint_file:
+				np.savez_compressed(checkpoint_file, kinematics=self.kinematics, team=self.team,
+									captured=self.captured, meta=np.array(json.dumps(meta)))
+			os.chmod(temp_path, mode)
+			os.replace(temp_path, path)
+		except BaseException:
+			if os.path.exists(temp_path):
+				os.remove(temp_path)
+			raise
+
+	def entities(self):
+		# keyword arguments for an Entity of each row
+		for i, (name, captain, kind, created_on) in enumerate(zip(*(self.columns[column] for column in
+																("name", "captain", "type", "created_on")))):
+			yield {"name": name, "captain": captain, "entity_type": kind, "created_on": created_on,
+					"r": self.kinematics["r"][i], "v": self.kinematics["v"][i], "a": self.kinematics["a"][i],
+					"team": int(self.team[i]), "captured": dotwar_table.captured_value(int(self.captured[i]))}
+
+
+class Checkpoints:
+	def __init__(self, directory: str, name: str, interval: datetime.timedelta, keep: int):
+		if interval <= datetime.timedelta(0) or keep < 1:
+			raise ValueError("checkpoints need a positive interval and keep")
+		self.directory = directory
+		self.name = name
+		self.interval = interval
+		self.keep = keep
+		self.unsaved = []  # Checkpoints taken since the last save, oldest first
+		self.saved = None  # times of the checkpoints on disk, oldest first, listed on first use
+		self.lock = threading.Lock()  # save() and before() both run under the game's read lock
+
+	def _saved(self):
+		if self.saved is None:
+			self.saved = [time for time, _ in checkpoint_files(self.directory, self.name)]
+		return self.saved
+
+	def next_due(self, now: datetime.datetime):
+		# system time the next checkpoint should be taken at: straight away if there are none yet
+		with self.lock:
+			latest = self.unsaved[-1].time if self.unsaved else (self._saved()[-1] if self._saved() else None)
+		return now if latest is None else latest + self.interval
+
+	def take(self, game):
+		with dotwar_metrics.span("checkpoint"):
+			checkpoint = Checkpoint.of(game)
+		dotwar_metrics.count("checkpoints")
+		with self.lock:
+			# a long catch-up can take more than are kept
+			self.unsaved = (self.unsaved + [checkpoint])[-self.keep:]
+
+	def before(self, moment: datetime.datetime):
+		# the latest checkpoint taken at or before moment, or None
+		with self.lock:
+			for checkpoint in reversed(self.unsaved):
+				if checkpoint.time <= moment:
+					return checkpoint
+			earlier = [time for time in self._saved() if time <= moment]
+			if not earlier:
+				return None
+			return Checkpoint.read(os.path.join(self.directory, filename(self.name, earlier[-1])))
+
+	def save(self, mode=0o644):
+		# write out the checkpoints taken since the last save and drop the oldest beyond keep
+		with self.lock:
+			for checkpoint in self.unsaved:
+				checkpoint.write(os.path.join(self.directory, filename(self.name, checkpoint.time)), mode)
+			self.unsaved = []
+			files = checkpoint_files(self.directory, self.name)
+			for _, file in files[:-self.keep]:
+				os.remove(os.path.join(self.directory, file))
+			self.saved = [time for time, _ in files[-self.keep:]]
+
+	def remove(self):
+		with self.lock:
+			for _, file in checkpoint_files(self.directory, self.name):
+				os.remove(os.path.join(self.directory, file))
+			self.unsaved = []
+			self.saved = []
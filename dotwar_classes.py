@@ -1,10 +1,26 @@
-import copy
 import os
+import stat
+import sys
+import tempfile
+import threading
 import datetime
 import json
 import uuid
 import numpy as np
 import math
+import logging
+
+import dotwar_checkpoints
+import dotwar_events
+import dotwar_filters
+import dotwar_metrics
+import dotwar_orders
+import dotwar_physics
+import dotwar_preview
+import dotwar_snapshot
+import dotwar_table
+
+log = logging.getLogger(__name__)
 
 def dist(a, b):
 	c = np.array(b) - np.array(a)
@@ -29,6 +45,13 @@ class team:
 	ATTACKER = 1
 
 class Entity:
+	# attributes visible to everyone through /scan. assigning any of them bumps version,
+	# which invalidates the entity's cached public view (see public_json).
+	PUBLIC_ATTRIBUTES = frozenset(("name", "captain", "r", "v", "a", "entity_type", "team", "created_on", "captured"))
+	# r, v, a, team, entity_type and captured live in a row of the game's EntityTable (a private one for a
+	# standalone entity). r, v and a read as views of that row: copy them to keep a value past the next change.
+	__slots__ = ("version", "public_cache", "table", "row", "name", "captain", "created_on", "authcode", "scheduler")
+
 	def __init__(self,
 				name: str,
 				captain: str,
@@ -40,30 +63,117 @@ class Entity:
 				team: int,
 				created_on: datetime.datetime or str,
 				authcode: str or None = None,
-				captured: bool or None = None):
-		self.name = name
-		self.captain = captain
-		self.r = r if type(r) is np.array else np.array(r)
-		self.v = v if type(v) is np.array else np.array(v)
-		self.a = a if type(a) is np.array else np.array(a)
-		self.entity_type = entity_type
+				captured: bool or None = None,
+				scheduler: dotwar_orders.OrderScheduler or None = None,
+				table: dotwar_table.EntityTable or None = None):
+		# set without __setattr__, there's no version to bump yet (games load thousands of entities at a time)
+		init = object.__setattr__
+		init(self, "version", 0)
+		init(self, "public_cache", None)  # (version, public dict, encoded public dict)
+		table = table if table is not None else dotwar_table.EntityTable(capacity=1)
+		init(self, "table", table)
+		init(self, "row", table.fill(r, v, a, team, entity_type, captured))
+		# names come up again and again (order parents, indexes, events), keep one copy of each
+		init(self, "name", sys.intern(name))
+		init(self, "captain", sys.intern(captain) if type(captain) is str else captain)
+		init(self, "created_on", created_on if type(created_on) is datetime.datetime
+			else datetime.datetime.fromisoformat(created_on))
+		init(self, "authcode", authcode)
+		# pending orders are kept by the game's scheduler (or a private one for a standalone entity)
+		init(self, "scheduler", scheduler if scheduler is not None else dotwar_orders.OrderScheduler())
 		self.pending = pending
-		self.team = team
-		self.created_on = created_on if type(created_on) is datetime.datetime\
-			else datetime.datetime.fromisoformat(created_on)
-		self.authcode = authcode
-		self.captured = captured
+
+	def __setattr__(self, attribute, value):
+		object.__setattr__(self, attribute, value)
+		if attribute in self.PUBLIC_ATTRIBUTES:
+			object.__setattr__(self, "version", self.version + 1)
+
+	@property
+	def r(self):
+		return self.table.r[self.row]
+
+	@r.setter
+	def r(self, value):
+		self.table.r[self.row] = value
+
+	@property
+	def v(self):
+		return self.table.v[self.row]
+
+	@v.setter
+	def v(self, value):
+		self.table.v[self.row] = value
+
+	@property
+	def a(self):
+		return self.table.a[self.row]
+
+	@a.setter
+	def a(self, value):
+		self.table.a[self.row] = value
+
+	@property
+	def team(self):
+		return int(self.table.team[self.row])
+
+	@team.setter
+	def team(self, value: int):
+		self.table.team[self.row] = value
+
+	@property
+	def entity_type(self):
+		return self.table.kinds[self.table.kind[self.row]]
+
+	@entity_type.setter
+	def entity_type(self, value: str):
+		self.table.kind[self.row] = self.table.kind_code(value)
+
+	@property
+	def captured(self):
+		return dotwar_table.captured_value(self.table.captured[self.row])
+
+	@captured.setter
+	def captured(self, value: bool or None):
+		self.table.captured[self.row] = dotwar_table.captured_code(value)
+
+	def detach(self):
+		# give the entity's row back to its game's table, e.g. once it's destroyed, keeping its values
+		# in a private table so anything still holding the entity reads what it had
+		table = dotwar_table.EntityTable(capacity=1)
+		row = table.allocate()
+		for column in ("r", "v", "a", "team", "captured"):
+			getattr(table, column)[row] = getattr(self.table, column)[self.row]
+		table.kind[row] = table.kind_code(self.entity_type)
+		self.table.release(self.row)
+		object.__setattr__(self, "table", table)
+		object.__setattr__(self, "row", row)
+
+	def rebound(self, table: dotwar_table.EntityTable, scheduler: dotwar_orders.OrderScheduler):
+		# a copy of the entity at the same row of another table (a copy of this one's, see Game.fork),
+		# sharing its name, captain and cached public view until either of them changes
+		entity = object.__new__(Entity)
+		for attribute in ("version", "public_cache", "row", "name", "captain", "created_on", "authcode"):
+			object.__setattr__(entity, attribute, getattr(self, attribute))
+		object.__setattr__(entity, "table", table)
+		object.__setattr__(entity, "scheduler", scheduler)
+		return entity
+
+	@property
+	def pending(self):
+		return self.scheduler.pending(self.name)
+
+	@pending.setter
+	def pending(self, orders: list):
+		self.scheduler.clear(self.name)
+		for order in orders:
+			order["parent_entity"] = self.name
+			self.scheduler.add(order)
 
 	def get_pending(self):
 		return self.pending
 
 	def get_json_pending(self):
-		pend_list = copy.deepcopy(self.get_pending())
-
-		for order in pend_list:
-			order["time"] = order["time"].isoformat()
-
-		return pend_list
+		return [order.as_json() for order in self.get_pending()]
 
 	def as_json(self):
 		json_compatible = {
@@ -74,6 +184,7 @@ class Entity:
 			"a": self.a.tolist(),
 			"type": self.entity_type,
 			"pending": self.get_json_pending(),  # <- can this be comprehended/lambda'd/mapped?
+			"next_order_id": self.scheduler.next_ids.get(self.name, 0),
 			"team": self.team,
 			"created_on": self.created_on.isoformat(),
 		}
@@ -86,6 +197,26 @@ class Entity:
 
 		return json_compatible
 
+	def public_json(self):
+		# as_json without pending orders, authcode and next_order_id, returned as (dict, encoded JSON).
+		# built once per version; callers must not modify the dict.
+		cache = self.public_cache
+		if cache is None or cache[0] != self.version:
+			public = {
+				"name": self.name,
+				"captain": self.captain,
+				"r": self.r.tolist(),
+				"v": self.v.tolist(),
+				"a": self.a.tolist(),
+				"type": self.entity_type,
+				"team": self.team,
+				"created_on": self.created_on.isoformat(),
+			}
+			if type(self.captured) is bool:
+				public["captured"] = self.captured
+			cache = self.public_cache = (self.version, public, json.dumps(public))
+		return cache[1], cache[2]
+
 	def add_order(self, task, args, time):
 		# order example: {"task":"burn", args:{"a":[0, 20, 1]}, "time":datetime}
 		order = {
@@ -102,29 +233,19 @@ class Entity:
 		if not all([type(e) in [int, float] for e in args["a"]]):
 			raise Exception(f"Acceleration must be a list of integers or floats, not {[type(e) for e in args['a']]}")
 
-		order["order_id"] = (max([pending_order["order_id"] for pending_order in self.get_pending()]) + 1)\
-			if len(self.get_pending()) else 0
 		order["parent_entity"] = self.name
-		self.pending.append(order)
-		print("ADDING ORDER WITH TIME:", str(order["time"]))
-		return order["order_id"]
+		order_id = self.scheduler.add(order)
+		log.debug("vessel %s added order %s at %s", self.name, order_id, order["time"])
+		return order_id
 
 	def get_order(self, order_id: int):
 		if type(order_id) != int:
 			raise TypeError("order_id must be integer")
 
-		for order in self.get_pending():
-			print("testing order ", order["order_id"])
-			if order["order_id"] == order_id:
-				print("found match")
-				return order
-			print("...not match")
+		return self.scheduler.get(self.name, order_id)
 
 	def clear_order(self, order_id):
-		pending = self.get_pending()
-		valid = list(filter(lambda o: o["order_id"] != order_id, pending))
-		# print(valid)
-		self.pending = valid
+		self.scheduler.cancel(self.name, order_id)
 
 
 # units are hours ! !!
@@ -136,21 +257,41 @@ def motion(entity: Entity, delta: float):
 	return [dr, dv]
 
 
-def sort_orders(orders):
-	orders.sort(key=lambda o: o["time"])
-	return orders
-
-
 def motion_seconds(entity: Entity, delta: float or int):
 	return motion(entity, delta / 3600.0)
 
 
 class Game:
-	def __init__(self, name: str, game_path: str, load=True, force_new = False):
+	# simulation engines selectable per game:
+	#  loop: step each Entity individually every SIM_TICK (reference implementation)
+	#  vector: step the whole fleet as (N,3) arrays every SIM_TICK, syncing entities only at segment ends and events
+	#  analytic: jump each segment in closed form, stopping only at encounters and when vessels reach lightspeed
+	#  adaptive: as vector in the limit of short ticks, but with steps as long as no encounter can happen within them,
+	#   and SIM_TICK otherwise. vessels at lightspeed turn towards their acceleration as vector's per-tick clamp has them,
+	#   without the slight extra distance each of vector's ticks adds on top
+	ENGINES = ("loop", "vector", "analytic", "adaptive")
+	# save formats:
+	#  json: one system.<name>.json file
+	#  snapshot: binary kinematics plus a compact side file, for large games (see dotwar_snapshot)
+	STORAGES = ("json", "snapshot")
+	# public entity fields with an index (value -> entity names) for filters, and the Entity attribute behind each
+	INDEXED_ATTRIBUTES = {"team": "team", "type": "entity_type", "captain": "captain"}
+
+	def __init__(self, name: str, game_path: str, load=True, force_new = False, engine="loop", storage=None,
+				checkpoints=None):
+		# storage=None uses whichever format the game is already saved in, or json for a new game.
+		# checkpoints: {"interval": seconds of system time, "keep": how many} to take kinematic checkpoints
+		# for rewind(), or None not to
+		if engine not in self.ENGINES:
+			raise ValueError(f"Unknown simulation engine '{engine}', expected one of {self.ENGINES}")
 		self.name = name
+		self.engine = engine
 		self.system_path = game_path
-		self.system_filename = f"system.{self.name}.json"
-		self.full_path = os.path.join(self.system_path, self.system_filename)
+		if storage is None:
+			snapshot_exists = os.path.exists(os.path.join(game_path, dotwar_snapshot.side_filename(name)))
+			storage = "snapshot" if snapshot_exists else "json"
+		self.set_storage(storage)
+		self.events_path = os.path.join(self.system_path, f"system.{self.name}.events.jsonl")
 		if not force_new and not os.path.exists(self.full_path):
 			raise Exception("new game being created in illegal context")
 		self.system = {"game":
@@ -160,7 +301,7 @@ class Game:
 						"system_time": datetime.datetime.now()
 						},
 						"entities": dict[str, Entity](),
-						"event_log": []
+						"event_log": dotwar_events.EventLog(self.events_path)
 					}
 		# self.system_time = datetime.datetime.now()
 		# constants:
@@ -175,9 +316,37 @@ class Game:
 		self.MAX_INSTANT_VEL = self.LIGHTSPEED
 		self.SIM_TICK = datetime.timedelta(seconds=30)  # in seconds.
 
+		self.scheduler = dotwar_orders.OrderScheduler()  # pending orders of every entity
+		self.table = dotwar_table.EntityTable()  # kinematics and such of every entity, see Entity
+		self.checkpoints = dotwar_checkpoints.Checkpoints(game_path, name,
+			datetime.timedelta(seconds=checkpoints["interval"]), checkpoints["keep"]) if checkpoints else None
+
+		self.disk_mtime = None  # mtime of the save file as of our last load or save
+		self.version = 0  # bumped by every mark_dirty
+		self.instance = uuid.uuid4().hex[:8]  # tells versions of this Game apart from those of a reloaded one
+		self.public_cache = None  # (version, encoded public entity list)
+		# for entities_since: entity name -> (Entity.version, game version it was first seen at),
+		# and destroyed entity name -> game version its removal was seen at
+		self.change_log = dict()
+		self.removal_log = dict()
+		self.change_lock = threading.Lock()
+		self.entity_index = {field: dict() for field in self.INDEXED_ATTRIBUTES}  # see INDEXED_ATTRIBUTES
+		self.event_listeners = []  # called with each event add_event adds, e.g. by dotwar_stream
+		self.previews = dotwar_preview.PreviewCache()  # for /preview, see dotwar_preview
+		self.dirty = False  # see mark_dirty
+		self.save_lock = threading.Lock()  # one save at a time, so the event log is never appended twice
 		if self.save_exists() and load:
 			self.load()
 
+	def set_storage(self, storage: str):
+		# the next save() writes this format, and removes the game's files in the other one
+		if storage not in self.STORAGES:
+			raise ValueError(f"Unknown storage format '{storage}', expected one of {self.STORAGES}")
+		self.storage = storage
+		self.system_filename = dotwar_snapshot.side_filename(self.name) if storage == "snapshot"\
+			else f"system.{self.name}.json"
+		self.full_path = os.path.join(self.system_path, self.system_filename)
+
 	def save_exists(self):
 		# check if save file exists already. note this does not verify the contents of the save.
 		return (os.path.exists(self.system_path) and os.path.exists(
@@ -199,91 +368,220 @@ class Game:
 		if self.save_exists() and not overwrite:  # if there's a save file, and we aren't supposed to touch it:
 			return
 		elif overwrite:  # overwriting. doesn't matter if file already exists.
-			system_file = open(self.full_path, "w")
-			fresh_json = {
-				"game": {"name": self.name, "created_on": start.isoformat(), "last_modified": start.isoformat(),
-						"system_time": datetime.datetime.now().isoformat()}, "entities": [], "event_log": []}
-			json.dump(fresh_json, system_file)
-			system_file.close()
+			fresh_game = {"name": self.name, "created_on": start.isoformat(), "last_modified": start.isoformat(),
+						"system_time": datetime.datetime.now().isoformat()}
+			if self.storage == "snapshot":
+				dotwar_snapshot.write(self.system_path, self.name, fresh_game, [], [], 0)
+			else:
+				system_file = open(self.full_path, "w")
+				fresh_json = {"game": fresh_game, "entities": [], "event_count": 0}
+				json.dump(fresh_json, system_file)
+				system_file.close()
+			dotwar_events.EventLog(self.events_path).remove()
+			if self.checkpoints is not None:
+				self.checkpoints.remove()
 
 	def load(self):
-		system_file = open(os.path.join(self.system_path, self.system_filename), "r")
-		loaded_system = json.load(system_file)
-
-		# convert time strings to datetimes:
-		loaded_system["game"]["created_on"] = datetime.datetime.fromisoformat(loaded_system["game"]["created_on"])
-		loaded_system["game"]["last_modified"] = datetime.datetime.fromisoformat(loaded_system["game"]["last_modified"])
-		loaded_system["game"]["system_time"] = datetime.datetime.fromisoformat(loaded_system["game"]["system_time"])
-
-		sys_entities = dict()
-		for json_entity in loaded_system["entities"]:
-			# convert order time strings to datetime objects
-			for order in json_entity["pending"]:
-				order["time"] = datetime.datetime.fromisoformat(order["time"])
-
-			entity = Entity(
-				name=json_entity["name"],
-				captain=json_entity["captain"],
-				r=json_entity["r"],
-				v=json_entity["v"],
-				a=json_entity["a"],
-				entity_type=json_entity["type"],
-				pending=json_entity["pending"],
-				team=json_entity["team"],
-				created_on=json_entity["created_on"]
-			)
-
-			try:
-				entity.authcode = json_entity["authcode"]
-			except KeyError:
-				pass
-
-			try:
-				entity.captured = json_entity["captured"]
-			except KeyError:
-				pass
-
-			sys_entities[json_entity["name"]] = entity
-
-		loaded_system["entities"] = sys_entities
-
-		self.system = loaded_system
-
-		# print("SYSTEM TIME:",str(self.system["game"]["system_time"]))
-		system_file.close()
-
-	def save(self):
-		system_file = open(self.full_path, "w")
-		"""
-		#convert system datetime to time string
-		self.system["game"]["system_time"] = self.system["game"]["system_time"].isoformat()
-		#convert np arrays representing entity vectors to lists
-		for entity in self.system["entities"]:
-			entity["r"] = entity["r"].tolist()
-			entity["v"] = entity["v"].tolist()
-			entity["a"] = entity["a"].tolist()
-		#convert order and event dates to strings
-		for order in self.get_pending():
-			order["time"] = order["time"].isoformat()
-
-		self.system["game"]["last_modified"] = datetime.datetime.now().isoformat()
-		json.dump(self.system, system_file, indent=4)
-		"""
-		print(self.system_as_json())
-		json.dump(self.system_as_json(), system_file, indent=4)
-		system_file.close()
-
-	def system_as_json(self):
-		return {"game":
-					{"name": self.system["game"]["name"],
-					"created_on": self.system["game"]["created_on"].isoformat(),
-					"last_modified": self.system["game"]["last_modified"].isoformat(),
-					"system_time": self.get_system_time().isoformat()
-					},
-					"entities": [entity.as_json() for entity in self.system["entities"].values()],
-					"event_log": self.system["event_log"]
+		with dotwar_metrics.span("load"):
+			if self.storage == "snapshot":
+				loaded_system = dotwar_snapshot.read(self.system_path, self.name)
+			else:
+				with open(self.full_path, "r") as system_file:
+					loaded_system = json.load(system_file)
+
+			# convert time strings to datetimes:
+			loaded_system["game"]["created_on"] = datetime.datetime.fromisoformat(loaded_system["game"]["created_on"])
+			loaded_system["game"]["last_modified"] = datetime.datetime.fromisoformat(loaded_system["game"]["last_modified"])
+			loaded_system["game"]["system_time"] = datetime.datetime.fromisoformat(loaded_system["game"]["system_time"])
+
+			scheduler = dotwar_orders.OrderScheduler()
+			table = dotwar_table.EntityTable(capacity=max(len(loaded_system["entities"]), dotwar_table.INITIAL_CAPACITY))
+			sys_entities = dict()
+			pending = []  # every entity's orders, handed to the scheduler in one go
+			for json_entity in loaded_system["entities"]:
+				pending.extend(dotwar_orders.Order(order["task"], order["args"], datetime.datetime.fromisoformat(order["time"]),
+												json_entity["name"], order.get("order_id"))
+							for order in json_entity["pending"])
+
+				entity = Entity(
+					name=json_entity["name"],
+					captain=json_entity["captain"],
+					r=json_entity["r"],
+					v=json_entity["v"],
+					a=json_entity["a"],
+					entity_type=json_entity["type"],
+					pending=[],
+					team=json_entity["team"],
+					created_on=json_entity["created_on"],
+					authcode=json_entity.get("authcode"),
+					captured=json_entity.get("captured"),
+					scheduler=scheduler,
+					table=table
+				)
+
+				# order ids aren't reused, even for orders that have since been carried out
+				scheduler.next_ids[entity.name] = max(scheduler.next_ids.get(entity.name, 0),
+													json_entity.get("next_order_id", 0))
+
+				sys_entities[json_entity["name"]] = entity
+
+			scheduler.extend(pending)
+			loaded_system["entities"] = sys_entities
+
+			event_log = dotwar_events.EventLog(self.events_path)
+			if "event_log" in loaded_system:  # saved before the event log had its own file
+				event_log.load_legacy(loaded_system["event_log"])
+			else:
+				event_log.load(loaded_system.pop("event_count", None))
+			loaded_system["event_log"] = event_log
+
+			self.system = loaded_system
+			self.scheduler = scheduler
+			self.table = table
+			self.entity_index = {field: dict() for field in self.INDEXED_ATTRIBUTES}
+			for entity in sys_entities.values():
+				self._index_entity(entity)
+
+			# print("SYSTEM TIME:",str(self.system["game"]["system_time"]))
+			self.disk_mtime = os.stat(self.full_path).st_mtime_ns
+			self.dirty = False
+
+	def save(self, indent=None):
+		# indent only applies to the json format
+		with self.save_lock, dotwar_metrics.span("save"):
+			# events go first: the system file records how many of them belong to it
+			self.system["event_log"].flush()
+			# keep the permissions the save file already had
+			mode = stat.S_IMODE(os.stat(self.full_path).st_mode) if os.path.exists(self.full_path) else 0o644
+			if self.storage == "snapshot":
+				dotwar_snapshot.write(self.system_path, self.name, self.game_as_json(),
+									list(self.system["entities"].values()),
+									[order.as_json() for order in self.scheduler.all_pending()],
+									len(self.system["event_log"]), mode)
+				# a game converted from json leaves no stale json save behind
+				json_path = os.path.join(self.system_path, f"system.{self.name}.json")
+				if os.path.exists(json_path):
+					os.remove(json_path)
+			else:
+				self._save_json(indent, mode)
+				if os.path.exists(os.path.join(self.system_path, dotwar_snapshot.side_filename(self.name))):
+					dotwar_snapshot.remove(self.system_path, self.name)
+			if self.checkpoints is not None:
+				self.checkpoints.save(mode)
+			self.disk_mtime = os.stat(self.full_path).st_mtime_ns
+			self.dirty = False
+
+	def _save_json(self, indent, mode):
+		# write to a temporary file beside the save and rename it over the old one,
+		# so neither readers nor a crash mid-write ever see a half-written system file
+		temp_descriptor, temp_path = tempfile.mkstemp(dir=self.system_path, prefix=f".{self.system_filename}.", suffix=".tmp")
+		try:
+			with os.fdopen(temp_descriptor, "w") as system_file:
+				json.dump(self.system_as_json(include_events=False), system_file, indent=indent)
+			# mkstemp files are private
+			os.chmod(temp_path, mode)
+			os.replace(temp_path, self.full_path)
+		except BaseException:
+			if os.path.exists(temp_path):
+				os.remove(temp_path)
+			raise
+
+	def mark_dirty(self):
+		# in-memory state has changes the save file doesn't. also invalidates public_entities_json.
+		self.dirty = True
+		self.version += 1
+
+	def changed_on_disk(self):
+		# true if the save file was replaced or removed since we last loaded or saved it
+		try:
+			return os.stat(self.full_path).st_mtime_ns != self.disk_mtime
+		except FileNotFoundError:
+			return True
+
+	def game_as_json(self):
+		return {"name": self.system["game"]["name"],
+				"created_on": self.system["game"]["created_on"].isoformat(),
+				"last_modified": self.system["game"]["last_modified"].isoformat(),
+				"system_time": self.get_system_time().isoformat()
 				}
 
+	def system_as_json(self, include_events=True):
+		with dotwar_metrics.span("serialize"):
+			system = {"game": self.game_as_json(),
+						"entities": [entity.as_json() for entity in self.system["entities"].values()]
+					}
+			if include_events:
+				system["event_log"] = list(self.system["event_log"])
+			else:  # the events themselves are in the event log file
+				system["event_count"] = len(self.system["event_log"])
+			return system
+
+	def public_entities(self, entity_filter: dotwar_filters.Filter or None = None):
+		# every entity's public view as a dict (see Entity.public_json), or those that pass entity_filter
+		entities = self.system["entities"].values()
+		if not entity_filter:
+			return [entity.public_json()[0] for entity in entities]
+		names = entity_filter.candidates(self.entity_index)
+		if names is not None:
+			# only entities the indexes let through get a public view built and checked
+			entities = [entity for entity in entities if entity.name in names]
+		views = [entity.public_json()[0] for entity in entities]
+		return [view for view in views if entity_filter.matches(view, skip=self.entity_index)]
+
+	def _index_entity(self, entity: Entity):
+		for field, attribute in self.INDEXED_ATTRIBUTES.items():
+			self.entity_index[field].setdefault(getattr(entity, attribute), set()).add(entity.name)
+
+	def _unindex_entity(self, entity: Entity):
+		for field, attribute in self.INDEXED_ATTRIBUTES.items():
+			names = self.entity_index[field].get(getattr(entity, attribute), set())
+			names.discard(entity.name)
+			if not names:
+				self.entity_index[field].pop(getattr(entity, attribute), None)
+
+	def public_entities_json(self):
+		# the encoded list of public_entities, reused until the game next changes
+		cache = self.public_cache
+		if cache is None or cache[0] != self.version:
+			with dotwar_metrics.span("serialize"):
+				encoded = "[" + ", ".join(entity.public_json()[1] for entity in self.system["entities"].values()) + "]"
+			cache = self.public_cache = (self.version, encoded)
+			# whoever gets this version's token can later ask what changed since
+			with self.change_lock:
+				self._note_changes()
+		return cache[1]
+
+	def version_token(self):
+		# identifies the current state of the game's public view, for since_version and ETags
+		return f"{self.instance}.{self.version}"
+
+	def entities_since(self, token: str):
+		# public views of the entities changed after the version in token, and names of those destroyed since.
+		# (views, removed), or None if token doesn't belong to this instance of the game.
+		instance, _, version = token.partition(".")
+		if instance != self.instance or not version.isdigit():
+			return None
+		version = int(version)
+		with self.change_lock:
+			self._note_changes()
+			changed = [self.system["entities"][name].public_json()[0]
+					for name, (_, seen) in self.change_log.items() if seen > version]
+			removed = [name for name, seen in self.removal_log.items() if seen > version]
+		return changed, removed
+
+	def _note_changes(self):
+		# date each entity's last change to the game version it was first noticed at. that may be later
+		# than the change itself, which only ever makes entities_since send an entity it didn't strictly need to.
+		entities = self.system["entities"]
+		for name, entity in entities.items():
+			noted = self.change_log.get(name)
+			if noted is None or noted[0] != entity.version:
+				self.change_log[name] = (entity.version, self.version)
+				self.removal_log.pop(name, None)
+		for name in [name for name in self.change_log if name not in entities]:
+			del self.change_log[name]
+			self.removal_log[name] = self.version
+
 	def add_entity(self, name, captain_name, r, v, a, entity_type, pending, team, new_authcode=False):
 		if self.get_entity(name):
 			return False
@@ -298,10 +596,14 @@ class Game:
 			pending=pending,
 			team=team,
 			created_on=datetime.datetime.now(),
-			authcode=str(uuid.uuid4()) if new_authcode else None
+			authcode=str(uuid.uuid4()) if new_authcode else None,
+			scheduler=self.scheduler,
+			table=self.table
 		)
 
 		self.system["entities"][name] = entity
+		self._index_entity(entity)
+		self.mark_dirty()
 		# print(json.dumps(self.system, indent=4))
 		return True  # success
 
@@ -329,41 +631,43 @@ class Game:
 
 	def edit_entity(self, entity_name, attribute, value):
 		entity = self.get_entity(entity_name)
+		indexed = attribute in self.INDEXED_ATTRIBUTES.values()
+		if indexed:
+			self._unindex_entity(entity)
 		entity.__setattr__(attribute, value)
+		if indexed:
+			self._index_entity(entity)
+		self.mark_dirty()
 
 	def get_pending(self, entity_name=None):
 		if entity_name:
 			return self.get_entity(entity_name).get_pending()
 		else:
-			pending = []
-			for entity in self.system["entities"].values():
-				pending += entity.get_pending()
-			return pending
+			return self.scheduler.all_pending()
 
 	def clear_pending(self, entity_name):
 		self.edit_entity(entity_name, "pending", [])
 
-	def get_orders_by_time(self, start, end):
-		orders = []
-		for order in self.get_pending():
-			if (order["time"] >= start) and (order["time"] <= end):
-				orders.append(order)
-		print("UNSORTED ORDER TIMES:", [str(order["time"]) for order in orders])
-		return orders
-
 	def update_interval(self, interval: datetime.timedelta):
 		# update interval of constant acceleration
 		# interval should be in seconds
 		this_moment = self.get_system_time()
 
-		print("\nSTARTING NEW UPDATE SEGMENT FROM",
-			str(this_moment),
-			"TO", str(this_moment + interval),
-			(" (interval of " + str(interval) + ")")
-			)
+		log.debug("game %s: segment from %s to %s (interval of %s)", self.name, this_moment, this_moment + interval, interval)
 
+		if self.engine == "analytic":
+			time = self._update_interval_analytic(this_moment, interval)
+		elif self.engine == "adaptive":
+			time = self._update_interval_adaptive(this_moment, interval)
+		elif self.engine == "vector":
+			time = self._update_interval_vector(this_moment, interval)
+		else:
+			time = self._update_interval_loop(this_moment, interval)
+
+		self.add_system_time(time)
+
+	def _update_interval_loop(self, this_moment: datetime.datetime, interval: datetime.timedelta):
 		time = datetime.timedelta(seconds=0)  # elapsed time in seconds
-		collisions = []
 		instant = self.SIM_TICK  # time per tick in seconds
 		while time < interval:
 			for entity in self.system["entities"].values():
@@ -374,126 +678,328 @@ class Game:
 				if mag(entity.v) > self.MAX_INSTANT_VEL:  # limit entities to lightspeed
 					entity.v = (entity.v / mag(entity.v)) * self.MAX_INSTANT_VEL
 			# print("TEST1 velocity:", self.get_entity("TEST1")["v"])
-			unfiltered_collisions = self.test_collisions()  # get "colliding" entities
-			new_collisions = filter(lambda c: not c in collisions, unfiltered_collisions)
-			# filter collisions so objects remaining in radius after one timestep don't
-			# keep generating collisions and events:
-			"""for collision in unfiltered_collisions:
-				if not (collision in collisions):
-					new_collisions.append(collision)"""
-			collisions = new_collisions
-			# find collisions that create events
-			for collision in collisions:
-				entity_a, entity_b, collision_type = collision
-				if entity_a.entity_type == "craft":
-					# capture check:
-					if collision_type == 'CAPTURE':
-						event = {"type": "capture", "args": {"attacker": entity_a.name, "planet": entity_b.name, "kinematics":{"r":entity_a.r.tolist(), "v":entity_a.v.tolist(), "a":entity_a.a.tolist()}},
-								"time": (this_moment + time).isoformat()}
-						self.add_event(event)
-						entity_b.captured = True
-						print(event["args"]["attacker"], "captured planet", event["args"]["planet"], "at",
-							str(event["time"]))
-					# defense check:
-					elif collision_type == 'DEFENSE':
-						event = {"type": "defense", "args":
-							{"defender": entity_a.name, "victim": entity_b.name, "defender_kinematics":{"r":entity_a.r.tolist(), "v":entity_a.v.tolist(), "a":entity_a.a.tolist()}, "victim_kinematics":{"r":entity_b.r.tolist(), "v":entity_b.v.tolist(), "a":entity_b.a.tolist()}},
-								"time": (this_moment + time).isoformat()}
-						self.add_event(event)
-						self.system["entities"].__delitem__(entity_b.name)
-						print(event["args"]["defender"], "destroyed vessel", event["args"]["victim"], "at",
-							str(event["time"]))
+			# objects remaining in radius after one timestep keep colliding, but captured planets
+			# stop being capturable and destroyed vessels are removed, so neither repeats an event.
+			self.resolve_collisions(self.test_collisions(), this_moment + time)
 			time += instant
+			dotwar_metrics.count("ticks")
+		return time
 
-		self.add_system_time(time)
-		print("ENDING SEGMENT AT SYSTEM TIME", str(self.get_system_time()))
+	def _update_interval_vector(self, this_moment: datetime.datetime, interval: datetime.timedelta):
+		time = datetime.timedelta(seconds=0)
+		instant = self.SIM_TICK
+		fleet = dotwar_physics.Fleet(self.system["entities"].values())
+		while time < interval:
+			fleet.step(instant.total_seconds() / 3600.0, self.MAX_INSTANT_VEL)
+			found = fleet.collisions(self.CAPTURE_RADIUS, self.DEFENSE_RADIUS)
+			if found:
+				# events record kinematics, so entities need to be current before resolving
+				fleet.sync()
+				destroyed = self.resolve_collisions(
+					[(fleet.entities[i], fleet.entities[j], kind) for i, j, kind in found], this_moment + time)
+				for i, j, kind in found:
+					if kind == 'CAPTURE':
+						fleet.mark_captured(j)
+				if destroyed:
+					fleet.remove([i for i, entity in enumerate(fleet.entities) if entity in destroyed])
+			time += instant
+			dotwar_metrics.count("ticks")
+		fleet.sync()
+		return time
+
+	def _update_interval_adaptive(self, this_moment: datetime.datetime, interval: datetime.timedelta):
+		# each step is as long as no attacker/planet or defender/attacker pair can reach its radius in it
+		# (Fleet.safe_step), but at least SIM_TICK, after which collisions are checked as in the vector engine.
+		# so a long step never passes an encounter, and one is detected at most SIM_TICK after it begins.
+		# steps also end where a vessel reaches lightspeed. it then keeps that speed, turning towards its acceleration
+		# (see Fleet._turned), which is what the vector engine's clamp does to it tick by tick.
+		duration = max(interval, datetime.timedelta(0)).total_seconds() / 3600.0  # hours
+		tick = self.SIM_TICK.total_seconds() / 3600.0
+		elapsed = 0.0
+		fleet = dotwar_physics.Fleet(self.system["entities"].values())
+		while duration - elapsed > dotwar_physics.MIN_SEGMENT:
+			turning = fleet.pinned(self.MAX_INSTANT_VEL)
+			a = fleet.effective_acceleration(self.MAX_INSTANT_VEL)
+			remaining = duration - elapsed
+			horizon = min(remaining, fleet.time_to_lightspeed(a, self.MAX_INSTANT_VEL))
+			# a turning vessel's path bends by no more than its full acceleration would
+			safe = min(fleet.safe_step(fleet.a, self.CAPTURE_RADIUS, self.DEFENSE_RADIUS, horizon), horizon)
+			# a pair within its radius already, reached exactly at the end of the last step
+			if safe <= 0 and self._resolve_fleet_collisions(fleet, this_moment + datetime.timedelta(hours=elapsed)):
+				continue
+			step = min(remaining, max(safe, tick))
+			fleet.advance(step, a, self.MAX_INSTANT_VEL, turning)
+			elapsed += step
+			dotwar_metrics.count("steps")
+			# only a step held to SIM_TICK can have an encounter begin within it
+			if safe < step:
+				dotwar_metrics.count("fine_steps")
+				self._resolve_fleet_collisions(fleet, this_moment + datetime.timedelta(hours=elapsed))
+		fleet.sync()
+		return max(interval, datetime.timedelta(0))
+
+	def _resolve_fleet_collisions(self, fleet: dotwar_physics.Fleet, moment: datetime.datetime):
+		# resolve_collisions for the fleet's current positions, returns whether there were any
+		found = fleet.collisions(self.CAPTURE_RADIUS, self.DEFENSE_RADIUS)
+		if found:
+			fleet.sync()
+			destroyed = self.resolve_collisions([(fleet.entities[i], fleet.entities[j], kind) for i, j, kind in found], moment)
+			for i, j, kind in found:
+				if kind == 'CAPTURE':
+					fleet.mark_captured(j)
+			if destroyed:
+				fleet.remove([i for i, entity in enumerate(fleet.entities) if entity in destroyed])
+		return bool(found)
+
+	def _update_interval_analytic(self, this_moment: datetime.datetime, interval: datetime.timedelta):
+		# no ticks: the segment is cut into pieces of constant acceleration at each encounter and each time
+		# a vessel reaches lightspeed, and each piece is propagated in one step.
+		duration = max(interval, datetime.timedelta(0)).total_seconds() / 3600.0  # hours
+		elapsed = 0.0
+		fleet = dotwar_physics.Fleet(self.system["entities"].values())
+		while duration - elapsed > dotwar_physics.MIN_SEGMENT:
+			a = fleet.effective_acceleration(self.MAX_INSTANT_VEL)
+			horizon = min(duration - elapsed, fleet.time_to_lightspeed(a, self.MAX_INSTANT_VEL))
+			encounter = fleet.first_encounter(a, self.CAPTURE_RADIUS, self.DEFENSE_RADIUS, horizon)
+			step = encounter[0] if encounter else horizon
+			fleet.advance(step, a, self.MAX_INSTANT_VEL)
+			elapsed += step
+			dotwar_metrics.count("segments")
+			if encounter:
+				# anything else touching its radius at the same moment collides too
+				found = fleet.collisions(self.CAPTURE_RADIUS * (1 + dotwar_physics.MIN_SEGMENT),
+										self.DEFENSE_RADIUS * (1 + dotwar_physics.MIN_SEGMENT))
+				if encounter[1] not in found:
+					found.append(encounter[1])
+				fleet.sync()
+				destroyed = self.resolve_collisions(
+					[(fleet.entities[i], fleet.entities[j], kind) for i, j, kind in found],
+					this_moment + datetime.timedelta(hours=elapsed))
+				for i, j, kind in found:
+					if kind == 'CAPTURE':
+						fleet.mark_captured(j)
+				if destroyed:
+					fleet.remove([i for i, entity in enumerate(fleet.entities) if entity in destroyed])
+		fleet.sync()
+		return max(interval, datetime.timedelta(0))
+
+	def resolve_collisions(self, collisions, moment: datetime.datetime):
+		# turn collisions into events. returns the list of vessels destroyed.
+		destroyed = []
+		dotwar_metrics.count("collisions", len(collisions))
+		for collision in collisions:
+			entity_a, entity_b, collision_type = collision
+			if entity_a.entity_type == "craft":
+				# capture check:
+				if collision_type == 'CAPTURE':
+					event = {"type": "capture", "args": {"attacker": entity_a.name, "planet": entity_b.name, "kinematics":{"r":entity_a.r.tolist(), "v":entity_a.v.tolist(), "a":entity_a.a.tolist()}},
+							"time": moment.isoformat()}
+					self.add_event(event)
+					entity_b.captured = True
+					log.info("game %s: %s captured planet %s at %s", self.name,
+						event["args"]["attacker"], event["args"]["planet"], event["time"])
+				# defense check:
+				elif collision_type == 'DEFENSE':
+					event = {"type": "defense", "args":
+						{"defender": entity_a.name, "victim": entity_b.name, "defender_kinematics":{"r":entity_a.r.tolist(), "v":entity_a.v.tolist(), "a":entity_a.a.tolist()}, "victim_kinematics":{"r":entity_b.r.tolist(), "v":entity_b.v.tolist(), "a":entity_b.a.tolist()}},
+							"time": moment.isoformat()}
+					self.add_event(event)
+					self.system["entities"].pop(entity_b.name, None)
+					self._unindex_entity(entity_b)
+					self.scheduler.drop_entity(entity_b.name)
+					entity_b.detach()
+					destroyed.append(entity_b)
+					log.info("game %s: %s destroyed vessel %s at %s", self.name,
+						event["args"]["defender"], event["args"]["victim"], event["time"])
+		return destroyed
 
 	def update(self, interval: datetime.timedelta):
 		# update over period of time (interval, in hours), including orders and changes in acceleration.
-		# collect orders in interval, and sort
-		real_start = datetime.datetime.now()
-		start_time = self.get_system_time()
-		end_time = start_time + interval
-		orders = sort_orders(self.get_orders_by_time(start_time, end_time))
-		# print("SORTED ORDER TIMES:", [str(order["time"]) for order in orders])
-		# self.update_interval for each interval
-		for order in orders:
-			self.update_interval(order["time"] - start_time)
-			entity = self.get_entity(order["parent_entity"])
-			if order["task"] == "burn":
-				a = np.array(order["args"]["a"])
-				#print(f"HANDLING ACCELERATION {a} of type {type(a)}")
-				a = ((a / mag(a)) * self.MAX_INSTANT_ACC) if (
-						mag(a) > self.MAX_INSTANT_ACC) else a  # limit acceleration to max
-				entity.a = a
-				self.add_event({'type': "burn",
-								"args": {
-									"vessel": entity.name,
-									"a": order["args"]["a"],
-									"kinematics":{"r":entity.r.tolist(), "v":entity.v.tolist(), "a":entity.a.tolist()}
-								},
-								"time": order["time"].isoformat()
-								})
-		# print("vessel", order["parent_entity"], "set new burn", order["args"], "at", str(order["time"]))
-		# update remaining subinterval between last order and end of whole interval
-		remaining_timedelta = end_time - self.get_system_time()
-		print("SEGMENTS DONE, REMAINING TIME", remaining_timedelta)
-		self.update_interval(remaining_timedelta)
-		print("FINISHED OVERALL UPDATE AT SYSTEM TIME", self.get_system_time())
-		print(f"simulation complete in {datetime.datetime.now() - real_start}")
-		# remove processed orders
-		for order in orders:
-			self.get_entity(order["parent_entity"]).clear_order(order["order_id"])
-		return
+		# orders come off the scheduler in time order; any already overdue are carried out straight away.
+		with dotwar_metrics.span("simulate"):
+			real_start = datetime.datetime.now()
+			start_time = self.get_system_time()
+			end_time = start_time + interval
+			# self.update_interval for each interval
+			while (order := self.scheduler.pop_due(end_time)) is not None:
+				self._advance_to(order["time"])
+				entity = self.get_entity(order["parent_entity"])
+				if entity is None:  # vessel was destroyed before its order came up
+					continue
+				if order["task"] == "burn":
+					a = np.array(order["args"]["a"])
+					#print(f"HANDLING ACCELERATION {a} of type {type(a)}")
+					a = ((a / mag(a)) * self.MAX_INSTANT_ACC) if (
+							mag(a) > self.MAX_INSTANT_ACC) else a  # limit acceleration to max
+					entity.a = a
+					self.add_event({'type': "burn",
+									"args": {
+										"vessel": entity.name,
+										"a": order["args"]["a"],
+										"kinematics":{"r":entity.r.tolist(), "v":entity.v.tolist(), "a":entity.a.tolist()}
+									},
+									"time": order["time"].isoformat()
+									})
+			# print("vessel", order["parent_entity"], "set new burn", order["args"], "at", str(order["time"]))
+			# update remaining subinterval between last order and end of whole interval
+			self._advance_to(end_time)
+			dotwar_metrics.count("entities", len(self.system["entities"]))
+			log.debug("game %s: simulated to %s in %s", self.name, self.get_system_time(), datetime.datetime.now() - real_start)
+			self.mark_dirty()
+			return
+
+	def _advance_to(self, moment: datetime.datetime):
+		# update_interval up to moment, stopping for any checkpoints that fall due on the way
+		if self.checkpoints is not None:
+			while (due := self.checkpoints.next_due(self.get_system_time())) <= moment:
+				self.update_interval(due - self.get_system_time())
+				self.checkpoints.take(self)
+		self.update_interval(moment - self.get_system_time())
+
+	def fork(self, orders_of=()):
+		# a scratch copy of the game to try things out on, never saved. the kinematics table is copied in one go
+		# and each entity only gets a light copy bound to it (see Entity.rebound), so forking costs little more
+		# than copying the arrays. only the orders of the entities named in orders_of come along, everyone
+		# else's are theirs to know. the copy's event log starts out empty.
+		fork = Game(f"{self.name}@fork", self.system_path, load=False, force_new=True, engine=self.engine)
+		fork.set_system_time(self.get_system_time())
+		fork.table = self.table.copy()
+		fork.system["entities"] = {name: entity.rebound(fork.table, fork.scheduler)
+									for name, entity in self.system["entities"].items()}
+		fork.entity_index = {field: {value: set(names) for value, names in index.items()}
+							for field, index in self.entity_index.items()}
+		for name in orders_of:
+			fork.scheduler.extend(dotwar_orders.Order(order.task, order.args, order.time, name, order.order_id)
+								for order in self.scheduler.pending(name))
+			fork.scheduler.next_ids[name] = self.scheduler.next_ids.get(name, 0)
+		return fork
+
+	def rewind(self, moment: datetime.datetime):
+		# a scratch copy of the game at its latest checkpoint at or before moment, with the burns logged since
+		# queued as orders: update_to(moment) it to see the game as it was then. None if there's no such checkpoint.
+		# the copy is never saved, and entities created after the checkpoint aren't in it.
+		checkpoint = self.checkpoints.before(moment) if self.checkpoints is not None else None
+		if checkpoint is None:
+			return None
+		past = Game(f"{self.name}@{checkpoint.time.isoformat()}", self.system_path, load=False, force_new=True,
+					engine=self.engine)
+		past.set_system_time(checkpoint.time)
+		for fields in checkpoint.entities():
+			entity = Entity(pending=[], scheduler=past.scheduler, table=past.table, **fields)
+			past.system["entities"][entity.name] = entity
+			past._index_entity(entity)
+		# by event id rather than time: an overdue order is carried out (and logged) after its own time
+		burns = self.get_event_log(None, moment, dotwar_filters.Filter({"type": "burn"}), checkpoint.event_id)
+		past.scheduler.extend(dotwar_orders.Order("burn", {"a": burn["args"]["a"]},
+												datetime.datetime.fromisoformat(burn["time"]),
+												burn["args"]["vessel"], burn["event_id"])
+							for burn in burns if burn["args"]["vessel"] in past.system["entities"])
+		return past
+
+	def intercepts(self, vessel_name: str, target_names=None, horizon=datetime.timedelta(days=7)):
+		# the burn (starting now) that takes the vessel to each target soonest, see dotwar_physics.intercept.
+		# target_names=None means every entity the vessel can capture or destroy. targets it can neither capture
+		# nor destroy are a rendezvous, to within the smaller of the two radii. raises LookupError for unknown names.
+		# returns {"target", "kind", "radius", "reachable", "hours", "time", "a"} per target, soonest first.
+		vessel = self.get_entity(vessel_name)
+		if vessel is None:
+			raise LookupError(f"No vessel named {vessel_name} in game {self.name}.")
+		if target_names is None:
+			targets = [entity for entity in self.system["entities"].values()
+					if self._intercept_kind(vessel, entity)[0] != "rendezvous"]
+		else:
+			targets = []
+			for name in target_names:
+				entity = self.get_entity(name)
+				if entity is None:
+					raise LookupError(f"No entity named {name} in game {self.name}.")
+				targets.append(entity)
+		kinds = [self._intercept_kind(vessel, entity) for entity in targets]
+
+		rows = [entity.row for entity in targets]
+		with dotwar_metrics.span("intercept"):
+			hours, a = dotwar_physics.intercept(vessel.r, vessel.v, self.table.r[rows], self.table.v[rows],
+												self.table.a[rows], [radius for _, radius in kinds],
+												self.MAX_INSTANT_ACC, self.MAX_INSTANT_VEL, horizon.total_seconds() / 3600.0)
+		now = self.get_system_time()
+		results = []
+		for entity, (kind, radius), t, burn in zip(targets, kinds, hours.tolist(), a.tolist()):
+			reachable = not math.isinf(t)
+			results.append({"target": entity.name, "kind": kind, "radius": radius, "reachable": reachable,
+							"hours": t if reachable else None,
+							"time": (now + datetime.timedelta(hours=t)).isoformat() if reachable else None,
+							"a": burn if reachable else None})
+		results.sort(key=lambda result: result["hours"] if result["reachable"] else math.inf)
+		return results
+
+	def _intercept_kind(self, vessel: Entity, entity: Entity):
+		# what reaching entity would mean for vessel, and within what distance: as in resolve_collisions
+		if vessel.entity_type == "craft" and entity is not vessel:
+			if vessel.team == team.ATTACKER and entity.entity_type == "planet" and entity.captured is False:
+				return "capture", self.CAPTURE_RADIUS
+			if vessel.team == team.DEFENDER and entity.team == team.ATTACKER:
+				return "defense", self.DEFENSE_RADIUS
+		return "rendezvous", min(self.CAPTURE_RADIUS, self.DEFENSE_RADIUS)
 
 	def update_to(self, end_date: datetime.datetime):
 		# end_date: datetime
 		now = self.get_system_time()
-		interval = abs(end_date - now)
-		if interval < datetime.timedelta(0):
-			raise ValueError(f"Simulation attempting to time travel by {interval} seconds.")
-		print("updating to", end_date, "with interval of", interval, "seconds")
+		interval = end_date - now
+		if interval <= datetime.timedelta(0):
+			# already there, or slightly past it: the tick engines round segments up to whole ticks.
+			# simulating abs(interval) here used to push such games further and further ahead.
+			return
+		log.debug("game %s: updating to %s, interval of %s", self.name, end_date, interval)
 		self.update(interval)
 
 	def test_collisions(self):
+		# candidates are looked up in grids partitioned by role instead of testing every pair.
+		# cells are as large as the largest interaction radius so one neighbourhood lookup covers both checks.
 		collisions = set()
-		entities = set(self.system["entities"].values())
+		entities = list(self.system["entities"].values())
+		cell_size = max(self.CAPTURE_RADIUS, self.DEFENSE_RADIUS)
+		capturable = dotwar_physics.SpatialGrid(cell_size,
+			filter(lambda e: e.entity_type == "planet" and e.captured is False, entities))
+		victims = dotwar_physics.SpatialGrid(cell_size, filter(lambda e: e.team == team.ATTACKER, entities))
+
 		for entity_a in filter(lambda e: e.entity_type != "planet", entities):
-			for entity_b in filter(lambda e: e.name != entity_a.name, entities):
-				# capture check:
-				if (entity_a.team == team.ATTACKER and
-						entity_b.entity_type == "planet" and
-						entity_b.captured is False and
-						(dist(entity_a.r, entity_b.r) <= self.CAPTURE_RADIUS)):
-					collisions.add((entity_a, entity_b, 'CAPTURE'))
-				# defense check:
-				if (entity_a.team == team.DEFENDER and
-						entity_b.team == 1 and
-						dist(entity_a.r, entity_b.r) <= self.DEFENSE_RADIUS):
-					collisions.add((entity_a, entity_b, 'DEFENSE'))
+			# capture check:
+			if entity_a.team == team.ATTACKER:
+				for entity_b in capturable.within(entity_a.r, self.CAPTURE_RADIUS):
+					if entity_b.name != entity_a.name:
+						collisions.add((entity_a, entity_b, 'CAPTURE'))
+			# defense check:
+			if entity_a.team == team.DEFENDER:
+				for entity_b in victims.within(entity_a.r, self.DEFENSE_RADIUS):
+					if entity_b.name != entity_a.name:
+						collisions.add((entity_a, entity_b, 'DEFENSE'))
 
 		return collisions
 
 	def add_event(self, event):
 		# event = {"type":burn|defense|capture, "args":{keys to entities or coords}, "time":ISO time string}
-		if self.system["event_log"]:
-			# event id is previous event id + 1
-			event["event_id"] = self.system["event_log"][-1]["event_id"] + 1
-		else:
-			event["event_id"] = 0
+		# the log assigns event_id
 		self.system["event_log"].append(event)
+		for listener in self.event_listeners:
+			listener(event)
 
-	def get_event_log(self, start: datetime.datetime, end: datetime.datetime):
+	def get_event_log(self, start: datetime.datetime, end: datetime.datetime,
+					event_filter: dotwar_filters.Filter or None = None, since_event_id: int or None = None):
+		# since_event_id: only events after that one (event ids count up from 0 in the order events are added)
 		start = start if start else datetime.datetime.fromtimestamp(0)  # the epoch
 		end = end if end else self.get_system_time()
-
-		if start:
-			events = []
-			for event in self.system["event_log"]:
-				if (datetime.datetime.fromisoformat(event["time"]) >= start) and (
-						datetime.datetime.fromisoformat(event["time"]) <= end):
-					events.append(event)
-		else:
-			events = self.system["event_log"]
-
-		return events
+		event_log = self.system["event_log"]
+		indexes = {"type": event_log.by_type}
+		positions = event_filter.candidates(indexes) if event_filter else None
+		if since_event_id is not None:
+			# an event's id is its position in the log
+			positions = range(max(since_event_id + 1, 0), len(event_log)) if positions is None\
+				else [position for position in positions if position > since_event_id]
+		events = event_log.between(start, end, positions)
+		if not event_filter:
+			return events
+		return [event for event in events if event_filter.matches(event, skip=indexes)]
+
+	def last_event_id(self):
+		# id of the latest event, or -1 if there are none yet
+		return len(self.system["event_log"]) - 1
@@ -0,0 +1,99 @@
+import bisect
+import datetime
+import json
+import os
+
+
+# append-only event log.
+# events live in memory in event_id order, with a sorted index of their parsed times for range queries
+# and an index of their types for filters, and on disk as one JSON object per line.
+# saving only appends the events added since the last flush.
+class EventLog:
+	def __init__(self, path: str):
+		self.path = path
+		self._clear()
+		self.flushed = 0  # how many events are already in the file
+
+	def _clear(self):
+		self.events = []
+		self.times = []  # parsed time of each event
+		self.index_times = []  # parsed event times, sorted
+		self.index_positions = []  # position in self.events of each entry of index_times
+		self.by_type = dict()  # event type -> positions in self.events, ascending
+
+	def __len__(self):
+		return len(self.events)
+
+	def __iter__(self):
+		return iter(self.events)
+
+	def __getitem__(self, item):
+		return self.events[item]
+
+	def __bool__(self):
+		return bool(self.events)
+
+	def append(self, event):
+		# event ids are the previous event id + 1
+		event["event_id"] = (self.events[-1]["event_id"] + 1) if self.events else 0
+		self._index(event)
+		return event
+
+	def _index(self, event):
+		time = datetime.datetime.fromisoformat(event["time"])
+		# events are almost always appended in time order, which makes this an append
+		position = bisect.bisect_right(self.index_times, time)
+		self.index_times.insert(position, time)
+		self.index_positions.insert(position, len(self.events))
+		self.by_type.setdefault(event.get("type"), []).append(len(self.events))
+		self.times.append(time)
+		self.events.append(event)
+
+	def between(self, start: datetime.datetime, end: datetime.datetime, positions=None):
+		# events with start <= time <= end, in event_id order.
+		# positions (e.g. from by_type) narrows it down to those events.
+		if positions is not None:
+			return [self.events[position] for position in sorted(positions) if start <= self.times[position] <= end]
+		low = bisect.bisect_left(self.index_times, start)
+		high = bisect.bisect_right(self.index_times, end)
+		return [self.events[position] for position in sorted(self.index_positions[low:high])]
+
+	def load(self, count=None):
+		# read the log file. count is the number of events the system file says were saved with it;
+		# lines beyond that were appended by a save that never completed, and are cut off.
+		self._clear()
+		if os.path.exists(self.path):
+			with open(self.path, "rb") as log_file:
+				offset = 0
+				for line in log_file:
+					if (count is not None and len(self.events) >= count) or not line.endswith(b"\n"):
+						break  # unsaved events, or a torn final line
+					self._index(json.loads(line))
+					offset += len(line)
+			if os.path.getsize(self.path) > offset:
+				with open(self.path, "r+b") as log_file:
+					log_file.truncate(offset)
+		self.flushed = len(self.events)
+
+	def load_legacy(self, events):
+		# events that came from a system file predating the log file. they get written out on the next flush.
+		self._clear()
+		for event in events:
+			self._index(event)
+		self.flushed = 0
+
+	def flush(self):
+		if self.flushed == len(self.events) and os.path.exists(self.path):
+			return
+		with open(self.path, "a" if self.flushed else "w") as log_file:
+			for event in self.events[self.flushed:]:
+				log_file.write(json.dumps(event) + "\n")
+			log_file.flush()
+			os.fsync(log_file.fileno())
+		self.flushed = len(self.events)
+
+	def remove(self):
+		if os.path.exists(self.path):
+			os.remove(self.path)
+		self._clear()
+		self.flushed = 0
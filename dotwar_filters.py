@@ -0,0 +1,83 @@
+import functools
+import numbers
+import re
+
+# the `filter` parameter of /scan and /summary: a JSON object of field -> condition, all of which must hold.
+# conditions:
+#  "pattern"                     regular expression searched for in str(value), as before
+#  {"regex": "pattern"}          the same, spelled out
+#  {"eq": value}                 value equals exactly
+#  {"min": low, "max": high}     numeric value within the range (inclusive, either end optional)
+#  any other JSON value          shorthand for {"eq": value}
+# a row without the field is matched as "" by regular expressions and as None otherwise.
+#
+# fields with an index (value -> ids of the rows having it, see Game.entity_index and EventLog.by_type)
+# are checked once per distinct value instead of once per row.
+
+PATTERN_CACHE_SIZE = 256
+CONDITIONS = ("regex", "eq", "min", "max")
+MISSING = object()  # value of a field the row doesn't have
+
+
+@functools.lru_cache(maxsize=PATTERN_CACHE_SIZE)
+def compile_pattern(pattern: str):
+	# shared across requests, so a client polling with the same filter never recompiles it
+	return re.compile(pattern)
+
+
+def _predicate(field, condition):
+	if type(condition) is str:
+		condition = {"regex": condition}
+	elif type(condition) is not dict:
+		condition = {"eq": condition}
+
+	unknown = [key for key in condition if key not in CONDITIONS]
+	if unknown:
+		raise ValueError(f"unknown condition {unknown[0]!r} for '{field}', expected one of {CONDITIONS}")
+	for bound in ("min", "max"):
+		if bound in condition and not isinstance(condition[bound], numbers.Real):
+			raise ValueError(f"'{bound}' for '{field}' must be a number")
+
+	tests = []
+	if "regex" in condition:
+		try:
+			pattern = compile_pattern(condition["regex"])
+		except (re.error, TypeError) as e:
+			raise ValueError(f"invalid pattern for '{field}': {e}")
+		tests.append(lambda value: pattern.search("" if value is MISSING else str(value)) is not None)
+	if "eq" in condition:
+		expected = condition["eq"]
+		# true and 1 are equal in Python, but not in a filter
+		tests.append(lambda value: (None if value is MISSING else value) == expected
+									and (type(value) is bool) == (type(expected) is bool))
+	if "min" in condition or "max" in condition:
+		low, high = condition.get("min", float("-inf")), condition.get("max", float("inf"))
+		tests.append(lambda value: isinstance(value, numbers.Real) and type(value) is not bool and low <= value <= high)
+	return lambda value: all(test(value) for test in tests)
+
+
+class Filter:
+	def __init__(self, spec: dict):
+		# raises ValueError if spec isn't a valid filter
+		if type(spec) is not dict:
+			raise ValueError("filter must be a JSON object")
+		self.predicates = {field: _predicate(field, condition) for field, condition in spec.items()}
+
+	def __bool__(self):
+		return bool(self.predicates)
+
+	def candidates(self, indexes: dict):
+		# ids of the rows that can match, from the indexed fields alone, or None if no field is indexed
+		ids = None
+		for field, predicate in self.predicates.items():
+			if field in indexes:
+				matching = set()
+				for value, bucket in indexes[field].items():
+					if predicate(value):
+						matching.update(bucket)
+				ids = matching if ids is None else ids & matching
+		return ids
+
+	def matches(self, row: dict, skip=()):
+		# skip: fields already settled by candidates()
+		return all(predicate(row.get(field, MISSING)) for field, predicate in self.predicates.items() if field not in skip)
@@ -0,0 +1,96 @@
+import collections
+import contextlib
+import threading
+import time
+
+
+# timing and counters for the server.
+# span() times a phase (load, simulate, serialize, save...) and count() tallies work done (ticks, collisions...).
+# both feed the process-wide METRICS, and, between begin_request() and end_request() on the same thread,
+# the current request's own breakdown. spans may nest (a save includes its serialize), so phases can overlap.
+class Metrics:
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.started = time.time()
+		self.phases = dict()  # phase -> [count, total seconds, max seconds]
+		self.routes = dict()  # route rule -> [count, total seconds, max seconds]
+		self.counters = collections.Counter()
+
+	@staticmethod
+	def _add(table, key, seconds):
+		entry = table.setdefault(key, [0, 0.0, 0.0])
+		entry[0] += 1
+		entry[1] += seconds
+		entry[2] = max(entry[2], seconds)
+
+	def record_phase(self, phase, seconds):
+		with self.lock:
+			self._add(self.phases, phase, seconds)
+
+	def record_route(self, route, seconds):
+		with self.lock:
+			self._add(self.routes, route, seconds)
+
+	def count(self, name, amount=1):
+		with self.lock:
+			self.counters[name] += amount
+
+	def snapshot(self):
+		def table(entries):
+			return {key: {"count": count, "total_seconds": total, "mean_seconds": total / count, "max_seconds": peak}
+					for key, (count, total, peak) in entries.items()}
+
+		with self.lock:
+			return {"uptime_seconds": time.time() - self.started,
+					"routes": table(self.routes),
+					"phases": table(self.phases),
+					"counters": dict(self.counters)}
+
+
+METRICS = Metrics()
+_request = threading.local()
+
+
+def begin_request():
+	_request.started = time.perf_counter()
+	_request.phases = dict()
+	_request.counters = collections.Counter()
+
+
+def end_request(route):
+	# finish the current request. returns (total seconds, {phase: seconds}, {counter: amount}), or None outside one.
+	if getattr(_request, "phases", None) is None:
+		return None
+	total = time.perf_counter() - _request.started
+	METRICS.record_route(route, total)
+	result = (total, _request.phases, _request.counters)
+	_request.phases = _request.counters = None
+	return result
+
+
+@contextlib.contextmanager
+def span(phase):
+	start = time.perf_counter()
+	try:
+		yield
+	finally:
+		elapsed = time.perf_counter() - start
+		METRICS.record_phase(phase, elapsed)
+		phases = getattr(_request, "phases", None)
+		if phases is not None:
+			phases[phase] = phases.get(phase, 0.0) + elapsed
+
+
+def count(name, amount=1):
+	METRICS.count(name, amount)
+	counters = getattr(_request, "counters", None)
+	if counters is not None:
+		counters[name] += amount
+
+
+def server_timing(total, phases, counters):
+	# Server-Timing header value, e.g. 'simulate;dur=12.300, total;dur=14.100;desc="ticks=120"'
+	parts = [f"{phase};dur={seconds * 1000:.3f}" for phase, seconds in phases.items()]
+	description = " ".join(f"{name}={amount}" for name, amount in counters.items())
+	parts.append(f"total;dur={total * 1000:.3f}" + (f';desc="{description}"' if description else ""))
+	return ", ".join(parts)
@@ -0,0 +1,157 @@
+import datetime
+import heapq
+import itertools
+import sys
+
+
+def local_time(moment: datetime.datetime):
+	# game and order times are naive local times, and can't be compared with offset-aware ones
+	if moment.tzinfo is not None:
+		return moment.astimezone().replace(tzinfo=None)
+	return moment
+
+
+# a pending order, stored with slots rather than as the dict it was given as, with its entity's name interned.
+# it still reads like that dict (order["time"], order.get("order_id")), which is how the game and routes use it.
+class Order:
+	__slots__ = ("task", "args", "time", "parent_entity", "order_id")
+
+	def __init__(self, task: str, args: dict, time, parent_entity: str, order_id: int or None = None):
+		self.task = sys.intern(task) if type(task) is str else task
+		self.args = args
+		self.time = time
+		self.parent_entity = sys.intern(parent_entity)
+		self.order_id = order_id
+
+	@classmethod
+	def from_dict(cls, order):
+		if type(order) is cls:
+			return order
+		return cls(order["task"], order["args"], order["time"], order["parent_entity"], order.get("order_id"))
+
+	def __getitem__(self, key):
+		if key not in self.__slots__:
+			raise KeyError(key)
+		return getattr(self, key)
+
+	def __setitem__(self, key, value):
+		if key not in self.__slots__:
+			raise KeyError(key)
+		setattr(self, key, value)
+
+	def __contains__(self, key):
+		return key in self.__slots__
+
+	def get(self, key, default=None):
+		return getattr(self, key) if key in self.__slots__ else default
+
+	def keys(self):
+		return self.__slots__
+
+	def as_json(self):
+		return {"task": self.task, "args": self.args, "time": self.time.isoformat(),
+				"parent_entity": self.parent_entity, "order_id": self.order_id}
+
+
+# game-wide queue of pending orders.
+# orders sit in a heap keyed by execution time for Game.update, and in per-entity dicts for agendas and lookups.
+# cancelling only removes an order from its dict; the heap entry left behind is a tombstone that is skipped
+# when it reaches the top, and the heap is rebuilt once tombstones outnumber live entries.
+class OrderScheduler:
+	def __init__(self):
+		self.heap = []  # (time, sequence, order)
+		self.sequence = itertools.count()  # tie-breaker so orders at the same time keep insertion order
+		self.orders = dict()  # entity name -> {order_id: order}, in insertion order
+		self.next_ids = dict()  # entity name -> next order id to hand out
+		self.tombstones = 0
+
+	def __len__(self):
+		return sum(len(orders) for orders in self.orders.values())
+
+	def add(self, order):
+		# order: an Order, or a dict with "task", "args", "time" and "parent_entity", kept as an Order.
+		# it's given the entity's next order id unless it has one, which is returned.
+		# it's only filed under its entity once it's in the heap, so an order that can't be queued isn't left behind
+		entry = self._entry(order)
+		try:
+			heapq.heappush(self.heap, entry)
+		except Exception:
+			# e.g. a time that can't be compared with the others'. the push appended the entry before failing
+			self.heap = [other for other in self.heap if other is not entry]
+			heapq.heapify(self.heap)
+			raise
+		self._register(entry[2])
+		return entry[2].order_id
+
+	def extend(self, orders):
+		# add many orders at once, heapifying once instead of pushing each. all of them or, if that fails, none
+		entries = [self._entry(order) for order in orders]
+		heap = self.heap + entries
+		heapq.heapify(heap)
+		self.heap = heap
+		for entry in entries:
+			self._register(entry[2])
+
+	def _entry(self, order):
+		# the order's heap entry, giving it the entity's next order id if it has none
+		order = Order.from_dict(order)
+		name = order.parent_entity
+		if order.order_id is None:
+			order.order_id = self.next_ids.get(name, 0)
+		self.next_ids[name] = max(self.next_ids.get(name, 0), order.order_id + 1)
+		return order.time, next(self.sequence), order
+
+	def _register(self, order):
+		# file the order under its entity
+		self.orders.setdefault(order.parent_entity, dict())[order.order_id] = order
+
+	def get(self, name: str, order_id: int):
+		return self.orders.get(name, {}).get(order_id)
+
+	def pending(self, name: str):
+		return list(self.orders.get(name, {}).values())
+
+	def all_pending(self):
+		return [order for orders in self.orders.values() for order in orders.values()]
+
+	def cancel(self, name: str, order_id: int):
+		order = self.orders.get(name, {}).pop(order_id, None)
+		if order is None:
+			return False
+		self.tombstones += 1
+		self._compact()
+		return True
+
+	def clear(self, name: str):
+		for order_id in list(self.orders.get(name, {})):
+			self.cancel(name, order_id)
+
+	def drop_entity(self, name: str):
+		self.clear(name)
+		self.orders.pop(name, None)
+		self.next_ids.pop(name, None)
+
+	def _live(self, order):
+		return self.orders.get(order.parent_entity, {}).get(order.order_id) is order
+
+	def peek_time(self):
+		# time of the next live order, or None
+		while self.heap and not self._live(self.heap[0][2]):
+			heapq.heappop(self.heap)
+			self.tombstones -= 1
+		return self.heap[0][0] if self.heap else None
+
+	def pop_due(self, end):
+		# remove and return the earliest order due at or before end, or None
+		time = self.peek_time()
+		if time is None or time > end:
+			return None
+		order = heapq.heappop(self.heap)[2]
+		del self.orders[order.parent_entity][order.order_id]
+		return order
+
+	def _compact(self):
+		if self.tombstones > len(self.heap) // 2:
+			self.heap = [entry for entry in self.heap if self._live(entry[2])]
+			heapq.heapify(self.heap)
+			self.tombstones = 0
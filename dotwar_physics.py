@@ -0,0 +1,370 @@
+import math
+
+import numpy as np
+
+import dotwar_table
+
+# batched kinematics for the whole system.
+# entities are packed into contiguous (N,3) arrays so one tick is a handful of numpy operations
+# regardless of fleet size. the arrays are only written back to the game's EntityTable when sync() is called.
+
+# team/type values mirror dotwar_classes.team; duplicated here so this module doesn't import dotwar_classes
+DEFENDER = 0
+ATTACKER = 1
+
+# analytic engine tolerances:
+MIN_SEGMENT = 1e-9  # hours (~3.6 microseconds). segments shorter than this are not worth splitting for
+LIGHTSPEED_TOLERANCE = 1e-9  # relative. speeds this close to MAX_INSTANT_VEL count as lightspeed
+ROOT_IMAG_TOLERANCE = 1e-6  # relative. polynomial roots with imaginary parts this small count as real
+
+# intercept solver:
+INTERCEPT_SAMPLES = 256  # times per target scanned for the first feasible one, which bisection then narrows down
+INTERCEPT_BISECTIONS = 48
+INTERCEPT_MIN_TIME = 1 / 3600.0  # hours, the earliest time scanned
+INTERCEPT_CHUNK = 1024  # targets solved at a time, each taking INTERCEPT_SAMPLES rows of scratch arrays
+INTERCEPT_AIM = 0.9  # aim this far inside the radius, so engines that only check every SIM_TICK see the arrival too
+
+
+class Fleet:
+	def __init__(self, entities):
+		self.entities = list(entities)
+		# entities of one game share its EntityTable (see dotwar_table), so their columns are gathered in one go
+		self.table = self.entities[0].table if self.entities else dotwar_table.EntityTable(capacity=0)
+		if any(entity.table is not self.table for entity in self.entities):
+			raise ValueError("a fleet's entities must all belong to the same game")
+		self.rows = np.array([entity.row for entity in self.entities], dtype=np.intp)
+		self.r = self.table.r[self.rows]
+		self.v = self.table.v[self.rows]
+		self.a = self.table.a[self.rows]
+		self.team = self.table.team[self.rows].astype(int)
+		kind = self.table.kind[self.rows]
+		self.is_planet = kind == self.table.kind_codes.get("planet", -1)
+		# only crafts capture or defend (see Game.resolve_collisions)
+		self.is_craft = kind == self.table.kind_codes.get("craft", -1)
+		# captured must be exactly False to be capturable (None means "not a capturable object")
+		self.capturable = self.table.captured[self.rows] == 0
+
+	def __len__(self):
+		return len(self.entities)
+
+	def step(self, delta: float, max_vel: float):
+		# advance every entity by delta hours, same formula as dotwar_classes.motion
+		self.r += self.v * delta + (1 / 2.0) * self.a * (delta ** 2.0)
+		self.v += self.a * delta
+
+		# limit entities to lightspeed
+		speed = np.sqrt(np.einsum("ij,ij->i", self.v, self.v))
+		over = speed > max_vel
+		if over.any():
+			self.v[over] = (self.v[over] / speed[over, np.newaxis]) * max_vel
+
+	def sync(self):
+		# write kinematics back to the entities' table, and mark each entity changed as assigning r, v and a would
+		self.table.r[self.rows] = self.r
+		self.table.v[self.rows] = self.v
+		self.table.a[self.rows] = self.a
+		for entity in self.entities:
+			entity.version += 1
+
+	def collisions(self, capture_radius: float, defense_radius: float):
+		# same rules as Game.test_collisions (for the collisions that produce events), evaluated as two pairwise distance matrices.
+		# returns list of (index_a, index_b, collision_type)
+		found = []
+		crafts = self.is_craft
+
+		attackers = np.flatnonzero(crafts & (self.team == ATTACKER))
+		planets = np.flatnonzero(self.is_planet & self.capturable)
+		if len(attackers) and len(planets):
+			for i, j in zip(*np.nonzero(self._distances(attackers, planets) <= capture_radius)):
+				found.append((attackers[i], planets[j], 'CAPTURE'))
+
+		defenders = np.flatnonzero(crafts & (self.team == DEFENDER))
+		victims = np.flatnonzero(self.team == ATTACKER)
+		if len(defenders) and len(victims):
+			for i, j in zip(*np.nonzero(self._distances(defenders, victims) <= defense_radius)):
+				if defenders[i] != victims[j]:
+					found.append((defenders[i], victims[j], 'DEFENSE'))
+
+		return found
+
+	def _distances(self, rows_a, rows_b):
+		c = self.r[rows_b][np.newaxis, :, :] - self.r[rows_a][:, np.newaxis, :]
+		return np.sqrt(np.einsum("ijk,ijk->ij", c, c))
+
+	def mark_captured(self, index):
+		self.capturable[index] = False
+
+	def remove(self, indices):
+		# drop destroyed entities. indices refer to the current arrays.
+		keep = np.ones(len(self.entities), dtype=bool)
+		keep[list(indices)] = False
+		self.entities = [entity for entity, kept in zip(self.entities, keep) if kept]
+		self.rows = self.rows[keep]
+		self.r = self.r[keep]
+		self.v = self.v[keep]
+		self.a = self.a[keep]
+		self.team = self.team[keep]
+		self.is_planet = self.is_planet[keep]
+		self.is_craft = self.is_craft[keep]
+		self.capturable = self.capturable[keep]
+
+	def _encounter_pairs(self):
+		# (rows_a, rows_b, kind) of the pairs that can collide, as in collisions()
+		crafts = self.is_craft
+		attackers = np.flatnonzero(crafts & (self.team == ATTACKER))
+		planets = np.flatnonzero(self.is_planet & self.capturable)
+		defenders = np.flatnonzero(crafts & (self.team == DEFENDER))
+		victims = np.flatnonzero(self.team == ATTACKER)
+		return [(attackers, planets, 'CAPTURE'), (defenders, victims, 'DEFENSE')]
+
+	def safe_step(self, a: np.ndarray, capture_radius: float, defense_radius: float, horizon=math.inf):
+		# longest time (hours) in which no attacker/planet pair can come within capture_radius and no
+		# defender/attacker pair within defense_radius, with entities accelerating at most by a. used by the adaptive engine.
+		# a pair's distance shrinks by at most |v_b - v_a| t + (|a_a| + |a_b|) t^2 / 2 in time t (capping speed at
+		# lightspeed only ever slows an entity's change of velocity), so the step is where that reaches the gap.
+		# anything from horizon up is as good as horizon to the caller.
+		best = math.inf
+		speed = _norms(self.v)
+		accel = _norms(a)
+		for (rows_a, rows_b, kind), radius in zip(self._encounter_pairs(), (capture_radius, defense_radius)):
+			if not (len(rows_a) and len(rows_b)):
+				continue
+			# crafts and planets, or defenders and attackers: the two sides never share an entity
+			gap = self._distances(rows_a, rows_b) - radius
+			if (gap <= 0).any():
+				return 0.0  # a pair is within its radius already
+			# the closest pair, as if it had the fastest and hardest accelerating entities of both sides.
+			# that's often enough to reach the horizon, without working out every pair's closing speed
+			step = _closing_time(gap.min(), speed[rows_a].max() + speed[rows_b].max(), accel[rows_a].max() + accel[rows_b].max())
+			if step < horizon:
+				c = self.v[rows_b][np.newaxis, :, :] - self.v[rows_a][:, np.newaxis, :]
+				closing = np.sqrt(np.einsum("ijk,ijk->ij", c, c))
+				spread = accel[rows_a][:, np.newaxis] + accel[rows_b][np.newaxis, :]
+				step = _closing_time(gap, closing, spread).min()
+			best = min(best, float(step))
+		return best
+
+	# -- closed-form propagation, used by the analytic engine --
+
+	def pinned(self, max_vel: float):
+		# vessels already at lightspeed that are still accelerating along their heading
+		speed_sq = np.einsum("ij,ij->i", self.v, self.v)
+		along = np.einsum("ij,ij->i", self.v, self.a)
+		return (speed_sq >= (max_vel * (1 - LIGHTSPEED_TOLERANCE)) ** 2) & (along > 0)
+
+	def effective_acceleration(self, max_vel: float):
+		# pinned vessels coast instead.
+		# this is exact when a is parallel to v, and ignores the slow turn towards a otherwise (see _turned)
+		a = self.a.copy()
+		a[self.pinned(max_vel)] = 0
+		return a
+
+	def _turned(self, delta: float, turning: np.ndarray, max_vel: float):
+		# r and v of the turning (pinned) vessels after delta hours, as the per-tick lightspeed clamp of step()
+		# has them in the limit of short ticks: at lightspeed, heading turning towards a at |a| sin(angle) / max_vel.
+		# with s = tan(angle / 2), s decays as exp(-|a| t / max_vel), and the heading integrates in closed form
+		v, a = self.v[turning], self.a[turning]
+		accel = _norms(a)
+		heading = a / accel[:, np.newaxis]
+		cos0 = np.clip(np.einsum("ij,ij->i", v, heading) / _norms(v), -1.0, 1.0)
+		across = v - (cos0 * _norms(v))[:, np.newaxis] * heading
+		across_norm = _norms(across)
+		side = np.divide(across, across_norm[:, np.newaxis], out=np.zeros_like(across),
+						where=across_norm[:, np.newaxis] > 0)
+		rate = accel / max_vel
+		s0 = np.tan(np.arccos(cos0) / 2)
+		s = s0 * np.exp(-rate * delta)
+		forward = delta + np.log((1 + s ** 2) / (1 + s0 ** 2)) / rate  # integral of cos(angle)
+		sideways = 2 * (np.arctan(s0) - np.arctan(s)) / rate  # integral of sin(angle)
+		r = self.r[turning] + max_vel * (forward[:, np.newaxis] * heading + sideways[:, np.newaxis] * side)
+		angle = 2 * np.arctan(s)
+		v = max_vel * (np.cos(angle)[:, np.newaxis] * heading + np.sin(angle)[:, np.newaxis] * side)
+		return r, v
+
+	def advance(self, delta: float, a: np.ndarray, max_vel: float, turning=None):
+		# jump every entity delta hours under constant acceleration a (see motion).
+		# turning: mask of pinned vessels that turn towards their own acceleration (see _turned) rather than
+		# moving under a, or None for none
+		if turning is not None and turning.any():
+			turned = self._turned(delta, turning, max_vel)
+		else:
+			turning = None
+		self.r += self.v * delta + (1 / 2.0) * a * (delta ** 2.0)
+		self.v += a * delta
+		if turning is not None:
+			self.r[turning], self.v[turning] = turned
+
+		# only trims floating point overshoot, segments are split before anything reaches lightspeed
+		speed = np.sqrt(np.einsum("ij,ij->i", self.v, self.v))
+		over = speed > max_vel
+		if over.any():
+			self.v[over] = (self.v[over] / speed[over, np.newaxis]) * max_vel
+
+	def time_to_lightspeed(self, a: np.ndarray, max_vel: float):
+		# earliest time (hours) any entity's speed reaches max_vel under acceleration a, or inf.
+		# solves |v + a t|^2 = max_vel^2 for each entity.
+		qa = np.einsum("ij,ij->i", a, a)
+		qb = 2 * np.einsum("ij,ij->i", self.v, a)
+		qc = np.einsum("ij,ij->i", self.v, self.v) - max_vel ** 2
+		disc = qb ** 2 - 4 * qa * qc
+		moving = (qa > 0) & (disc >= 0)
+		if not moving.any():
+			return math.inf
+		root = np.sqrt(disc[moving])
+		candidates = np.concatenate([(-qb[moving] - root) / (2 * qa[moving]), (-qb[moving] + root) / (2 * qa[moving])])
+		candidates = candidates[candidates > MIN_SEGMENT]
+		return float(candidates.min()) if len(candidates) else math.inf
+
+	def first_encounter(self, a: np.ndarray, capture_radius: float, defense_radius: float, horizon: float):
+		# earliest time in [0, horizon] hours at which any attacker/planet pair comes within capture_radius
+		# or any defender/attacker pair within defense_radius, with every entity under constant acceleration a.
+		# returns (time, (index_a, index_b, collision_type)) or None.
+		best = None
+		for (rows_a, rows_b, kind), radius in zip(self._encounter_pairs(), (capture_radius, defense_radius)):
+			if not (len(rows_a) and len(rows_b)):
+				continue
+			ia, ib = np.meshgrid(rows_a, rows_b, indexing="ij")
+			ia, ib = ia.ravel(), ib.ravel()
+			distinct = ia != ib
+			ia, ib = ia[distinct], ib[distinct]
+
+			# relative motion d(t) = p + q t + s t^2
+			p = self.r[ib] - self.r[ia]
+			q = self.v[ib] - self.v[ia]
+			s = (1 / 2.0) * (a[ib] - a[ia])
+
+			# cheap bound: pairs that can't close the gap within the horizon are skipped
+			reachable = _norms(p) - _norms(q) * horizon - _norms(s) * horizon ** 2 <= radius
+			for k in np.flatnonzero(reachable):
+				t = _first_crossing(p[k], q[k], s[k], radius, horizon)
+				if t is not None and (best is None or t < best[0]):
+					best = (t, (ia[k], ib[k], kind))
+
+		return best
+
+
+def _norms(x):
+	return np.sqrt(np.einsum("ij,ij->i", x, x))
+
+
+def _closing_time(gap, closing, spread):
+	# positive root t of spread t^2 / 2 + closing t = gap, for gap > 0. infinite if neither moves nor accelerates
+	denominator = closing + np.sqrt(closing ** 2 + 2 * spread * gap)
+	with np.errstate(divide="ignore"):
+		return 2 * gap / denominator
+
+
+def _first_crossing(p, q, s, radius, horizon):
+	# smallest t in [0, horizon] with |p + q t + s t^2| <= radius, or None.
+	# |d(t)|^2 - radius^2 is a quartic in t.
+	if p.dot(p) <= radius ** 2:
+		return 0.0
+	coefficients = np.trim_zeros(np.array([
+		s.dot(s),
+		2 * q.dot(s),
+		q.dot(q) + 2 * p.dot(s),
+		2 * p.dot(q),
+		p.dot(p) - radius ** 2
+	]), "f")
+	if len(coefficients) < 2:
+		return None
+	roots = np.roots(coefficients)
+	real = roots[np.abs(roots.imag) <= ROOT_IMAG_TOLERANCE * np.maximum(1, np.abs(roots.real))].real
+	real = np.sort(real[(real > 0) & (real <= horizon)])
+	return float(real[0]) if len(real) else None
+
+
+def intercept(r, v, target_r, target_v, target_a, radius, max_acc: float, max_vel: float, horizon: float):
+	# constant accelerations that take an entity at r with velocity v to within radius of each of M targets soonest,
+	# each target moving on under its own constant acceleration, all as in dotwar_classes.motion.
+	# the burn is at most max_acc, and mustn't take the entity past max_vel (the engines would cap it there).
+	# radius: one per target, aimed INTERCEPT_AIM of the way into. returns (t, a): (M,) hours, inf for targets
+	# not reachable within horizon, and (M,3).
+	#
+	# at time t the target has drifted to d(t) = p + q t + s t^2 relative to the entity, so a burn a puts the
+	# entity within radius of it iff |d(t) - a t^2 / 2| <= radius. the smallest such a points along d(t):
+	# |a| = 2 (|d(t)| - radius) / t^2. every target's times are scanned at once for the first where that burn
+	# is allowed, then bisected down to the earliest.
+	if len(target_r) > INTERCEPT_CHUNK:
+		chunks = [intercept(r, v, target_r[i:i + INTERCEPT_CHUNK], target_v[i:i + INTERCEPT_CHUNK],
+							target_a[i:i + INTERCEPT_CHUNK], radius[i:i + INTERCEPT_CHUNK], max_acc, max_vel, horizon)
+				for i in range(0, len(target_r), INTERCEPT_CHUNK)]
+		return np.concatenate([t for t, _ in chunks]), np.concatenate([a for _, a in chunks])
+	p = np.asarray(target_r, dtype=float) - r
+	q = np.asarray(target_v, dtype=float) - v
+	s = (1 / 2.0) * np.asarray(target_a, dtype=float)
+	aim = INTERCEPT_AIM * np.asarray(radius, dtype=float)
+
+	count = len(p)
+	t = np.full(count, math.inf)
+	a = np.zeros((count, 3))
+	if not count or horizon <= 0:
+		return t, a
+	times = np.geomspace(min(INTERCEPT_MIN_TIME, horizon), horizon, INTERCEPT_SAMPLES)
+	_, allowed = _intercept_burn(p, q, s, aim, v, np.broadcast_to(times, (count, len(times))), max_acc, max_vel)
+	reachable = allowed.any(axis=1)
+	first = allowed.argmax(axis=1)
+	# those within reach already need no burn at all
+	now = _norms(p) <= aim
+	t[now] = 0.0
+	todo = np.flatnonzero(reachable & ~now)
+	if len(todo):
+		low = np.where(first[todo] > 0, times[np.maximum(first[todo] - 1, 0)], 0.0)
+		high = times[first[todo]]
+		p, q, s, aim = p[todo], q[todo], s[todo], aim[todo]
+		for _ in range(INTERCEPT_BISECTIONS):
+			middle = (low + high) / 2
+			_, allowed = _intercept_burn(p, q, s, aim, v, middle[:, np.newaxis], max_acc, max_vel)
+			allowed = allowed[:, 0]
+			high = np.where(allowed, middle, high)
+			low = np.where(allowed, low, middle)
+		t[todo] = high
+		burns = _intercept_burn(p, q, s, aim, v, high[:, np.newaxis], max_acc, max_vel)[0][:, 0]
+		# rounding can leave the hardest burns a hair over max_acc
+		a[todo] = burns * np.minimum(1.0, max_acc / np.maximum(_norms(burns), max_acc))[:, np.newaxis]
+	return t, a
+
+
+def _intercept_burn(p, q, s, aim, v, t, max_acc, max_vel):
+	# the smallest burn reaching each target at each of its times t (M, K), and whether it's allowed
+	d = p[:, np.newaxis, :] + q[:, np.newaxis, :] * t[..., np.newaxis] + s[:, np.newaxis, :] * (t ** 2)[..., np.newaxis]
+	distance = np.sqrt(np.einsum("mkj,mkj->mk", d, d))
+	with np.errstate(divide="ignore", invalid="ignore"):
+		needed = np.where(distance > aim[:, np.newaxis], 2 * (distance - aim[:, np.newaxis]) / t ** 2, 0.0)
+		a = d * (needed / distance)[..., np.newaxis]
+	a[needed == 0] = 0.0
+	final = v + a * t[..., np.newaxis]
+	allowed = (needed <= max_acc) & (np.einsum("mkj,mkj->mk", final, final) <= (max_vel * (1 + LIGHTSPEED_TOLERANCE)) ** 2)
+	return a, allowed
+
+
+class SpatialGrid:
+	# uniform grid hash over entity positions. with cell_size >= the query radius,
+	# everything within the radius of a point lies in the 27 cells around it.
+	def __init__(self, cell_size: float, entities=()):
+		self.cell_size = float(cell_size)
+		self.cells = dict()
+		for entity in entities:
+			self.insert(entity)
+
+	def cell_of(self, r):
+		return (math.floor(r[0] / self.cell_size),
+				math.floor(r[1] / self.cell_size),
+				math.floor(r[2] / self.cell_size))
+
+	def insert(self, entity):
+		self.cells.setdefault(self.cell_of(entity.r), []).append(entity)
+
+	def nearby(self, r):
+		# candidates in the cell containing r and its 26 neighbours
+		x, y, z = self.cell_of(r)
+		for dx in (-1, 0, 1):
+			for dy in (-1, 0, 1):
+				for dz in (-1, 0, 1):
+					yield from self.cells.get((x + dx, y + dy, z + dz), ())
+
+	def within(self, r, radius: float):
+		for entity in self.nearby(r):
+			c = entity.r - r
+			if math.sqrt(c.dot(c)) <= radius:
+				yield entity
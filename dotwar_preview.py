@@ -0,0 +1,77 @@
+import collections
+import datetime
+import threading
+
+# what-if previews of a vessel's course, for /game/<name>/preview.
+# a fork of the game (see Game.fork) carrying only the vessel's own agenda, plus any hypothetical orders,
+# is simulated ahead through Game.update, sampling the vessel on the way. everyone else keeps their current
+# acceleration: their orders aren't the vessel's to know.
+#
+# previews are cached per game, and hold until the vessel's agenda changes or something happens in the game
+# (a new event or entity) that could change them, or until the game's time passes their end.
+DEFAULT_TAIL = datetime.timedelta(hours=1)  # previewed past the last order when no horizon is asked for
+CACHE_SIZE = 64
+
+
+def agenda_token(game, name: str):
+	# changes whenever the vessel's agenda does: orders are only ever added (with fresh ids) or taken away
+	return tuple(game.scheduler.orders.get(name, {})), game.scheduler.next_ids.get(name, 0)
+
+
+def cache_key(game, name: str, orders_key: str, horizon, samples: int):
+	return name, agenda_token(game, name), orders_key, horizon, samples, game.last_event_id(), len(game.system["entities"])
+
+
+def _sample(time: datetime.datetime, vessel):
+	return {"time": time.isoformat(), "r": vessel.r.tolist(), "v": vessel.v.tolist(), "a": vessel.a.tolist()}
+
+
+def project(fork, name: str, orders: list, horizon: datetime.timedelta or None, samples: int,
+			max_horizon: datetime.timedelta):
+	# orders: hypothetical orders as {"task", "args", "time"}, added to the vessel's agenda in the fork.
+	# horizon: how far ahead to look, or None for an hour past the last order
+	vessel = fork.get_entity(name)
+	for order in orders:
+		vessel.add_order(order["task"], order["args"], order["time"])
+	start = fork.get_system_time()
+	if horizon is None:
+		last = max([order["time"] for order in vessel.pending], default=start)
+		horizon = max(last - start, datetime.timedelta(0)) + DEFAULT_TAIL
+	until = start + min(horizon, max_horizon)
+
+	trajectory = [_sample(start, vessel)]
+	destroyed = False
+	for k in range(1, samples + 1):
+		fork.update_to(start + (until - start) * k / samples)
+		vessel = fork.get_entity(name)
+		if vessel is None:
+			destroyed = True
+			break
+		trajectory.append(_sample(fork.get_system_time(), vessel))
+	return {"start": start.isoformat(), "until": until.isoformat(), "trajectory": trajectory,
+			"events": list(fork.system["event_log"]), "destroyed": destroyed}
+
+
+class PreviewCache:
+	def __init__(self, size=CACHE_SIZE):
+		self.size = size
+		self.entries = collections.OrderedDict()  # cache_key -> (end of the preview, result)
+		self.lock = threading.Lock()
+
+	def get(self, key, now: datetime.datetime):
+		with self.lock:
+			entry = self.entries.get(key)
+			if entry is None:
+				return None
+			if entry[0] <= now:
+				del self.entries[key]
+				return None
+			self.entries.move_to_end(key)
+			return entry[1]
+
+	def put(self, key, result: dict):
+		with self.lock:
+			self.entries[key] = (datetime.datetime.fromisoformat(result["until"]), result)
+			self.entries.move_to_end(key)
+			while len(self.entries) > self.size:
+				self.entries.popitem(last=False)
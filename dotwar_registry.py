@@ -0,0 +1,347 @@
+import collections
+import concurrent.futures
+import contextlib
+import datetime
+import logging
+import multiprocessing
+import os
+import threading
+import time
+
+import dotwar_classes
+import dotwar_metrics
+
+log = logging.getLogger(__name__)
+
+
+# many readers or one writer.
+# waiting writers hold off new readers, so a steady stream of reads can't starve a simulation update.
+class ReadWriteLock:
+	def __init__(self):
+		self.condition = threading.Condition()
+		self.readers = 0
+		self.writing = False
+		self.writers_waiting = 0
+
+	@contextlib.contextmanager
+	def read(self):
+		with self.condition:
+			while self.writing or self.writers_waiting:
+				self.condition.wait()
+			self.readers += 1
+		try:
+			yield
+		finally:
+			with self.condition:
+				self.readers -= 1
+				if not self.readers:
+					self.condition.notify_all()
+
+	@contextlib.contextmanager
+	def write(self):
+		with self.condition:
+			self.writers_waiting += 1
+			while self.writing or self.readers:
+				self.condition.wait()
+			self.writers_waiting -= 1
+			self.writing = True
+		try:
+			yield
+		finally:
+			with self.condition:
+				self.writing = False
+				self.condition.notify_all()
+
+
+# one in-memory Game per name, shared by every route.
+# a game is reloaded when its save file changes underneath us (unless it has unsaved changes of its own),
+# and games nobody has asked for in a while (or beyond max_games, least recently used first) are saved and dropped.
+#
+# each game name has a ReadWriteLock: simulation and order changes take it for writing, serializing and saving
+# for reading. never call get() or catch_up() while holding a game's lock, both may need it for writing.
+class GameRegistry:
+	def __init__(self, game_dir: str, engine="loop", max_games=32, ttl=3600, storage=None, checkpoints=None):
+		self.game_dir = game_dir
+		self.engine = engine
+		self.storage = storage  # save format to convert games to as they're saved, None keeps each game's own
+		self.checkpoints = checkpoints  # passed on to every Game
+		self.max_games = max_games
+		self.ttl = ttl  # seconds
+		self.games = collections.OrderedDict()  # name -> Game, least recently used first
+		self.last_used = dict()  # name -> time.monotonic() of last get()
+		self.locks = dict()  # name -> ReadWriteLock
+		self.flights = dict()  # name -> threading.Lock held while that game is being caught up
+		self.warming = dict()  # name -> threading.Event set once a WarmUp is done with the game
+		# name -> Game dropped by _evict with unsaved changes, until it's saved. get() takes such a game back
+		# rather than loading the older save file, whose copy could overwrite the changes when it's next saved
+		self.evicted = dict()
+		self.lock = threading.Lock()  # guards the dicts above, never held while loading or simulating
+		# how far behind a shared catch-up may leave a game before a waiting request simulates the rest itself
+		self.tolerance = datetime.timedelta(seconds=1)
+
+	def __contains__(self, name):
+		return name in self.games
+
+	def __repr__(self):
+		return f"GameRegistry({list(self.games)})"
+
+	def lock_for(self, name: str):
+		with self.lock:
+			if name not in self.locks:
+				self.locks[name] = ReadWriteLock()
+				self.flights[name] = threading.Lock()
+			return self.locks[name]
+
+	def reading(self, name: str):
+		return self.lock_for(name).read()
+
+	def writing(self, name: str):
+		return self.lock_for(name).write()
+
+	def current(self, name: str):
+		# the loaded Game of that name, or None. unlike get(), never loads it
+		with self.lock:
+			return self.games.get(name)
+
+	def names(self):
+		with self.lock:
+			return list(self.games)
+
+	def get(self, name: str, touch=True):
+		# touch=False doesn't count as use for eviction (for background work)
+		with self.lock:
+			warming = self.warming.get(name)
+		if warming is not None:
+			# a pool process is catching the game up and will save it, load it after that
+			warming.wait()
+		game_lock = self.lock_for(name)
+		with self.lock:
+			game = self._loaded(name)
+		if game is None or (not game.dirty and game.changed_on_disk()):
+			with game_lock.write():
+				# someone may have loaded it while we waited
+				with self.lock:
+					game = self._loaded(name)
+				if game is None or (not game.dirty and game.changed_on_disk()):
+					game = dotwar_classes.Game(name, self.game_dir, engine=self.engine, checkpoints=self.checkpoints)
+					if self.storage is not None and game.storage != self.storage:
+						game.set_storage(self.storage)
+						game.mark_dirty()
+					with self.lock:
+						self.games[name] = game
+
+		with self.lock:
+			if touch or name not in self.last_used:
+				self.games.move_to_end(name)
+				self.last_used[name] = time.monotonic()
+			evicted = self._evict()
+		for dropped in evicted:
+			self._settle(dropped)
+		return game
+
+	def _loaded(self, name: str):
+		# call with self.lock held: the game in memory, or None
+		game = self.games.get(name)
+		if game is None and name in self.evicted:
+			game = self.games[name] = self.evicted[name]
+			self.last_used[name] = time.monotonic()
+		return game
+
+	def catch_up(self, name: str, until: datetime.datetime, touch=True):
+		# single flight: if another thread is already simulating this game, wait for it to finish
+		# and share its result instead of running the same simulation again.
+		# if that run stopped well short of `until` (e.g. a Ticker slice), take another turn.
+		game = self.get(name, touch)
+		flight = self.flights[name]
+		while True:
+			if flight.acquire(blocking=False):
+				try:
+					with self.writing(name):
+						game.update_to(until)
+				finally:
+					flight.release()
+				return game
+			with flight:
+				pass
+			dotwar_metrics.count("shared_catch_ups")
+			if game.get_system_time() >= until - self.tolerance:
+				return game
+
+	def warmed(self, name: str):
+		with self.lock:
+			warming = self.warming.pop(name, None)
+		if warming is not None:
+			warming.set()
+
+	def forget(self, name: str):
+		with self.lock:
+			self.games.pop(name, None)
+			self.last_used.pop(name, None)
+			self.evicted.pop(name, None)
+
+	def flush(self):
+		# save every game with unsaved changes
+		with self.lock:
+			games = list(self.games.values())
+			evicted = list(self.evicted.values())
+		for game in games:
+			if game.dirty:
+				self._save(game)
+		for game in evicted:
+			self._settle(game)
+
+	def _save(self, game):
+		try:
+			with self.reading(game.name):
+				game.save()
+		except Exception as e:
+			log.error("Failed to save game %s: %r", game.name, e)
+
+	def _settle(self, game):
+		# save a game dropped by _evict, and let go of it once it's saved (a failed save is retried by flush)
+		self._save(game)
+		with self.lock:
+			if self.evicted.get(game.name) is game and not game.dirty:
+				del self.evicted[game.name]
+
+	def _evict(self):
+		# drop idle and excess games. returns the dropped games that still need saving, which stay in
+		# self.evicted until they are
+		now = time.monotonic()
+		names = list(self.games)
+		# least recently used come first, so the expired games are a prefix of names
+		expired = sum(1 for name in names if now - self.last_used[name] > self.ttl)
+		evicted = []
+		for name in names[:max(expired, len(names) - self.max_games)]:
+			game = self.games.pop(name)
+			del self.last_used[name]
+			if game.dirty:
+				evicted.append(game)
+				self.evicted[name] = game
+		return evicted
+
+
+# write-behind persistence: requests only mark games dirty, and this thread saves them
+# every `interval` seconds (so bursts of requests coalesce into one write) and once more on stop().
+class Flusher(threading.Thread):
+	def __init__(self, registry: GameRegistry, interval=5.0):
+		super().__init__(name="dotwar-flusher", daemon=True)
+		self.registry = registry
+		self.interval = interval
+		self.stopped = threading.Event()
+
+	def run(self):
+		while not self.stopped.wait(self.interval):
+			self.registry.flush()
+
+	def stop(self):
+		self.stopped.set()
+		self.registry.flush()
+
+
+def advance(game_dir: str, name: str, engine: str, storage, checkpoints, until: datetime.datetime):
+	# run in a WarmUp pool process: load the game, simulate it to `until` and save it for the registry to load
+	game = dotwar_classes.Game(name, game_dir, engine=engine, checkpoints=checkpoints)
+	if storage is not None and game.storage != storage:
+		game.set_storage(storage)
+	game.update_to(until)
+	game.save()
+	return game.get_system_time()
+
+
+# after a restart, catches every listed game up to the present in a pool of processes rather than one by one
+# on their first requests, then loads them into the registry from the files the pool saved.
+# requests for a game wait until its warm-up is done, so the game is never simulated or saved twice at once.
+#
+# the pool forks, so start() before the server starts serving, while no other thread is busy:
+# it launches every process straight away.
+class WarmUp(threading.Thread):
+	def __init__(self, registry: GameRegistry, names: list, processes=None):
+		super().__init__(name="dotwar-warmup", daemon=True)
+		self.registry = registry
+		self.names = list(names)
+		self.processes = min(processes or os.cpu_count() or 1, len(self.names)) or 1
+		self.pool = None
+		self.futures = dict()  # Future -> game name
+		self.warmed = []
+		self.failed = dict()  # name -> error
+		self.started = None
+		self.finished = None
+		self.done = threading.Event()
+		with registry.lock:
+			for name in self.names:
+				registry.warming.setdefault(name, threading.Event())
+
+	def start(self):
+		self.started = time.monotonic()
+		if self.names:
+			until = datetime.datetime.now()
+			self.pool = concurrent.futures.ProcessPoolExecutor(self.processes, mp_context=multiprocessing.get_context("fork"))
+			self.futures = {self.pool.submit(advance, self.registry.game_dir, name, self.registry.engine,
+											self.registry.storage, self.registry.checkpoints, until): name
+							for name in self.names}
+			log.info("Warming up %d games in %d processes", len(self.names), self.processes)
+		super().start()
+
+	def run(self):
+		try:
+			for future in concurrent.futures.as_completed(self.futures):
+				name = self.futures[future]
+				try:
+					future.result()
+					self.registry.warmed(name)
+					self.registry.get(name, touch=False)
+					self.warmed.append(name)
+				except Exception as e:
+					# left to catch up on its first request as usual
+					log.error("Failed to warm up game %s: %r", name, e)
+					self.failed[name] = repr(e)
+					self.registry.warmed(name)
+		finally:
+			for name in self.names:
+				self.registry.warmed(name)
+			if self.pool is not None:
+				self.pool.shutdown()
+			self.finished = time.monotonic()
+			self.done.set()
+			log.info("Warm-up finished in %.1f s: %d games ready, %d failed", self.finished - self.started,
+					len(self.warmed), len(self.failed))
+
+	def status(self):
+		return {"ready": self.done.is_set(),
+				"games": len(self.names),
+				"warmed": len(self.warmed),
+				"failed": dict(self.failed),
+				"seconds": (self.finished or time.monotonic()) - self.started if self.started is not None else 0.0}
+
+
+# keeps games advanced to near real time in the background, so requests only simulate the last few seconds.
+# every `cadence` seconds each game (the listed names, or otherwise every loaded game) is caught up,
+# by at most `max_catchup` seconds of simulated time per pass so one stale game can't hold up the rest.
+class Ticker(threading.Thread):
+	def __init__(self, registry: GameRegistry, cadence=30.0, games=None, max_catchup=3600.0):
+		super().__init__(name="dotwar-ticker", daemon=True)
+		self.registry = registry
+		self.cadence = cadence
+		self.games = games
+		self.max_catchup = datetime.timedelta(seconds=max_catchup)
+		self.stopped = threading.Event()
+
+	def run(self):
+		while not self.stopped.wait(self.cadence):
+			self.tick()
+
+	def tick(self):
+		for name in (self.games if self.games is not None else self.registry.names()):
+			if self.stopped.is_set():
+				return
+			try:
+				# listed games are kept loaded, others are left to expire as usual
+				game = self.registry.get(name, touch=self.games is not None)
+				until = min(datetime.datetime.now(), game.get_system_time() + self.max_catchup)
+				self.registry.catch_up(name, until, touch=False)
+			except Exception as e:
+				log.error("Ticker failed to advance game %s: %r", name, e)
+
+	def stop(self):
+		self.stopped.set()
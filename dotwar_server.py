@@ -1,28 +1,44 @@
+import atexit
 import datetime
+import logging
 
 import bottle
 
 import dotwar_classes
+import dotwar_filters
+import dotwar_metrics
+import dotwar_orders
+import dotwar_preview
+import dotwar_registry
+import dotwar_shard
+import dotwar_stream
+import parser
 from bottle import run, route, request, hook, response, HTTPResponse, error
 import os
+import signal
 import sys
 import json
-import re
 import math
+import zlib
 # import urllib.parse
 from urllib.parse import unquote
 
 # Implemented endpoints:
 #  /games *
 #  /game/<name>/status
-#  /game/<name>/scan
+#  /game/<name>/scan, /game/<name>/scan?at=ISO date string
 #  /game/<name>/event_log, /game/<name>/summary
 #  /game/<name>/agenda?vessel=&authcode=
 #  /add_order?vessel=&authcode=&order={"task":"burn","args":{"a":[3d acceleration]}},"time":ISO date string}
+#  /add_orders?orders=[{"vessel":, "authcode":, "order":{as in add_order}}, ...]
+#  /game/<name>/preview?vessel=&authcode=&orders=[{as in add_order}, ...]
+#  /game/<name>/intercept?vessel=&targets=[names]
+#  /game/<name>/command?command=text&vessel=&authcode=
+#  /game/<name>/stream
+#  /metrics
+#  /ready
 #  ....
 
-GAMES = {}
-
 def load_config(directory=sys.path[0]):
 	if os.path.exists(os.path.join(directory, "config.json")):
 		config_file = open("config.json", "r")
@@ -37,6 +53,22 @@ def load_config(directory=sys.path[0]):
 			"game_dir": directory,
 			"static_dir": os.path.join(directory, "static"),
 			"debug": True,
+			"log_level": "INFO",
+			"engine": "loop",
+			"storage": None,
+			"max_loaded_games": 32,
+			"game_ttl": 3600,
+			"save_interval": 5,
+			"freshness": 1,
+			"max_batch_orders": 1000,
+			"numthreads": 32,
+			"stream": {"interval": 2, "heartbeat": 15, "queue_size": 256, "max_subscribers": None},
+			"shards": {"count": None, "threads": 16, "socket_dir": None},
+			"warmup": {"enabled": False, "processes": None},
+			"preview": {"max_horizon": 86400, "samples": 100, "max_samples": 1000},
+			"intercept": {"max_horizon": 604800, "max_targets": 1000},
+			"checkpoints": {"enabled": True, "interval": 3600, "keep": 48},
+			"ticker": {"enabled": False, "cadence": 30, "games": None, "max_catchup": 3600},
 			"welcome": "Welcome to the myrmidon/dotwar test server!"
 		}
 
@@ -44,15 +76,76 @@ def load_config(directory=sys.path[0]):
 global_config = load_config(sys.path[0])
 TMNS120 = 0
 
+logging.basicConfig(level=global_config.get("log_level", "INFO"),
+					format="%(asctime)s [%(levelname)s] %(name)s: %(message)s")
+log = logging.getLogger(__name__)
+
+# set by dotwar_shard in its worker processes: "<index>/<count>". such a process only serves its shard's games
+SHARD = tuple(int(part) for part in os.environ["DOTWAR_SHARD"].split("/")) if os.environ.get("DOTWAR_SHARD") else None
+
+
+def owns(name: str):
+	return SHARD is None or dotwar_shard.shard_of(name, SHARD[1]) == SHARD[0]
+
+
 def get_game_list():
+	# system.<name>.json, or system.<name>.snapshot.json for games saved in the snapshot format
 	files = os.listdir(global_config["game_dir"])
 	game_list = []
 	for file in files:
-		if file.startswith("system.") and file.endswith(".json"):
+		if file.startswith("system.") and file.endswith(".json") and file.split(".")[1] not in game_list:
 			game_list.append(file.split(".")[1])
 	return game_list
 
 
+checkpoint_config = dict({"interval": 3600, "keep": 48}, **global_config.get("checkpoints", {}))
+GAMES = dotwar_registry.GameRegistry(global_config["game_dir"],
+									engine=global_config.get("engine", "loop"),
+									max_games=global_config.get("max_loaded_games", 32),
+									ttl=global_config.get("game_ttl", 3600),
+									storage=global_config.get("storage"),
+									checkpoints=checkpoint_config if checkpoint_config.get("enabled", True) else None)
+WARMUP = None
+
+FLUSHER = dotwar_registry.Flusher(GAMES, interval=global_config.get("save_interval", 5))
+FLUSHER.start()
+atexit.register(FLUSHER.stop)
+
+FRESHNESS = datetime.timedelta(seconds=global_config.get("freshness", 1))
+MAX_BATCH_ORDERS = global_config.get("max_batch_orders", 1000)
+preview_config = global_config.get("preview", {})
+MAX_PREVIEW_HORIZON = datetime.timedelta(seconds=preview_config.get("max_horizon", 86400))
+PREVIEW_SAMPLES = preview_config.get("samples", 100)
+MAX_PREVIEW_SAMPLES = preview_config.get("max_samples", 1000)
+intercept_config = global_config.get("intercept", {})
+MAX_INTERCEPT_HORIZON = datetime.timedelta(seconds=intercept_config.get("max_horizon", 604800))
+MAX_INTERCEPT_TARGETS = intercept_config.get("max_targets", 1000)
+PARSER = parser.Parser()
+
+# threads answering requests. a shard worker gets its count from "shards" (see dotwar_shard)
+NUMTHREADS = global_config.get("shards", {}).get("threads", 16) if SHARD is not None \
+	else global_config.get("numthreads", 32)
+stream_config = global_config.get("stream", {})
+# every open stream holds a thread, so by default they may take at most half of them
+STREAMS = dotwar_stream.StreamHub(GAMES,
+								interval=stream_config.get("interval", 2),
+								heartbeat=stream_config.get("heartbeat", 15),
+								queue_size=stream_config.get("queue_size", 256),
+								max_subscribers=stream_config.get("max_subscribers") or max(1, NUMTHREADS // 2))
+atexit.register(STREAMS.stop)
+
+ticker_config = global_config.get("ticker", {})
+if ticker_config.get("enabled", False):
+	TICKER = dotwar_registry.Ticker(GAMES,
+									cadence=ticker_config.get("cadence", 30),
+									games=[name for name in ticker_config["games"] if owns(name)]
+										if ticker_config.get("games") is not None else None,
+									max_catchup=ticker_config.get("max_catchup", 3600))
+	TICKER.start()
+	atexit.register(TICKER.stop)  # atexit runs in reverse, so this stops before the final flush
+else:
+	TICKER = None
+
 def valid_json(json_string):
 	try:
 		json.loads(json_string)
@@ -68,6 +161,39 @@ def valid_datetime(iso_string):
 		return False
 	return True
 
+def still_current(name, game, vessel):
+	# call with the game's write lock held: whether vessel, looked up before the lock was taken, is still in the
+	# registry's game. the game may have been reloaded from disk or evicted since, and the vessel destroyed
+	return GAMES.current(name) is game and game.get_entity(vessel.name) is vessel
+
+
+def prepare_order(order):
+	# check an order from a request and fill in its time, for Entity.add_order. raises ValueError if it's invalid.
+	if type(order) is not dict:
+		raise ValueError(f"Order must be a JSON object, not {order!r}")
+	if type(order.get("task")) is not str:
+		raise ValueError("Order needs a 'task'.")
+	if type(order.get("args")) is not dict or type(order["args"].get("a")) is not list\
+			or len(order["args"]["a"]) != 3 or not all(type(e) in [int, float] and math.isfinite(e)
+														for e in order["args"]["a"]):
+		raise ValueError("Order needs 'args' with an acceleration 'a', a list of 3 finite numbers.")
+
+	if order.get("time") is None:
+		time = datetime.datetime.now()
+	elif "interval" in order:
+		if order["interval"] and type(order["time"]) in [int, float]:
+			time = datetime.datetime.now() + datetime.timedelta(seconds=order["time"])
+		else:
+			raise ValueError(f"Invalid interval parameter: {order['interval']} of type {type(order['interval'])}")
+	elif type(order["time"]) is str and valid_datetime(order["time"]):
+		time = dotwar_orders.local_time(datetime.datetime.fromisoformat(order["time"].replace('Z', '+00:00')))
+	else:
+		raise ValueError("Invalid time parameter.")
+
+	a = [float(e) for e in order["args"]["a"]]
+	return {"task": order["task"], "args": dict(order["args"], a=a), "time": time}
+
+
 def select_err(err, use_html):
 	return err if use_html else {"ok": False, "msg":err}
 
@@ -139,7 +265,9 @@ def game_status(name):
 
 	ret = {"ok": True, "game": None}
 
-	g_json = game.system_as_json()["game"]
+	with GAMES.reading(name):
+		g_json = game.game_as_json()
+		entity_count = len(game.system['entities'])
 	ret["game"] = g_json
 	if ("html" in query) and valid_json(query.html) and json.loads(query.html):
 		return "<br>".join(["Game '" + name + "' status:",
@@ -147,45 +275,20 @@ def game_status(name):
 								g_json["created_on"]).strftime("%b %d %Y, %X") + ")",
 							"System time: " + g_json["system_time"] + " (" + datetime.datetime.fromisoformat(
 								g_json["system_time"]).strftime("%b %d %Y, %X") + ")",
-		                    f"{len(game.system['entities'])} entities"
+		                    f"{entity_count} entities"
 							])
 	return ret
 
 
-@route("/game/<name>/scan", method="POST")
-def scan(name):
-	# FUNNY GLOBAL TRICK
-	#global TMNS120
-	#print("TMNS120", TMNS120)
-	#TMNS120 += 1
-
-	game = update_to_now(name)
-	json_entities = game.system_as_json()["entities"]
-	query = request.POST
-	print("HTTP?", query.html)
-
-	for entity in json_entities:
-		for culled_attribute in ["pending", "authcode"]:
-			try:
-				del entity[culled_attribute]
-			except:
-				pass
-
-	if ("filter" in query) and valid_json(query.filter):
-		filters = json.loads(query.filter)
-		json_entities = list(filter(lambda json_entity: all([re.search(filters[k], str(json_entity[k])) for k in filters]), json_entities))
-	elif ("filter" in query) and not valid_json(query.filter):
-		return {"ok": False, "msg": "invalid JSON provided in 'filter'"}
-
-	if ("html" in query) and valid_json(query.html) and json.loads(query.html):
-		rows = [[json_entity["name"], json_entity["type"], (json_entity["captain"] if json_entity["captain"] else "-----"),
-				f"<{json_entity['r'][0]:.3f} {json_entity['r'][1]:.3f} {json_entity['r'][2]:.3f}>",
-				f"<{json_entity['v'][0]:.3f} {json_entity['v'][1]:.3f} {json_entity['v'][2]:.3f}>",
-				f"<{json_entity['a'][0]:.3f} {json_entity['a'][1]:.3f} {json_entity['a'][2]:.3f}>",
-				["Defenders", "Attackers", "Itself"][json_entity["team"]]
-				] for json_entity in json_entities]
-		table = generate_table(["NAME", "TYPE", "CAPTAIN", "POSITION", "HEADING", "ACCELERATION", "ALLEGIANCE"], rows)
-		style_tag = """<style>
+def scan_page(json_entities):
+	rows = [[json_entity["name"], json_entity["type"], (json_entity["captain"] if json_entity["captain"] else "-----"),
+			f"<{json_entity['r'][0]:.3f} {json_entity['r'][1]:.3f} {json_entity['r'][2]:.3f}>",
+			f"<{json_entity['v'][0]:.3f} {json_entity['v'][1]:.3f} {json_entity['v'][2]:.3f}>",
+			f"<{json_entity['a'][0]:.3f} {json_entity['a'][1]:.3f} {json_entity['a'][2]:.3f}>",
+			["Defenders", "Attackers", "Itself"][json_entity["team"]]
+			] for json_entity in json_entities]
+	table = generate_table(["NAME", "TYPE", "CAPTAIN", "POSITION", "HEADING", "ACCELERATION", "ALLEGIANCE"], rows)
+	style_tag = """<style>
 table {
 	font-family: Roboto, sans-serif;
 	border-collapse: collapse;
@@ -202,12 +305,93 @@ tr:nth-child(even) {
 	background-color: #dddddd;
 }
 </style>"""
-		page = style_tag + table
-		return page
+	page = style_tag + table
+	return page
+
+
+def scan_at(name, game, query, entity_filter):
+	# the entities as they were at query.at, simulated forward from the game's nearest earlier checkpoint
+	if not valid_datetime(query.at):
+		response.status = 400
+		return {"ok": False, "msg": "at must be an ISO datetime string"}
+	at = dotwar_orders.local_time(datetime.datetime.fromisoformat(query.at.replace('Z', '+00:00')))
+	with GAMES.reading(name):
+		if at > game.get_system_time():
+			response.status = 400
+			return {"ok": False, "msg": f"at is after the game's system time, {game.get_system_time().isoformat()}"}
+		past = game.rewind(at)
+	if past is None:
+		response.status = 404
+		return {"ok": False, "msg": f"No checkpoint of game {name} goes back to {at.isoformat()}."}
+	checkpoint_time = past.get_system_time()
+	# only the copy is simulated, outside the game's lock
+	with dotwar_metrics.span("rewind"):
+		past.update_to(at)
+	json_entities = past.public_entities(entity_filter)
+	if ("html" in query) and valid_json(query.html) and json.loads(query.html):
+		return scan_page(json_entities)
+	return {"ok": True, "at": at.isoformat(), "checkpoint": checkpoint_time.isoformat(), "entities": json_entities}
+
+
+@route("/game/<name>/scan", method="POST")
+def scan(name):
+	# FUNNY GLOBAL TRICK
+	#global TMNS120
+	#print("TMNS120", TMNS120)
+	#TMNS120 += 1
+
+	game = update_to_now(name)
+	query = request.POST
+
+	entity_filter = None
+	if ("filter" in query) and valid_json(query.filter):
+		try:
+			entity_filter = dotwar_filters.Filter(json.loads(query.filter))
+		except ValueError as e:
+			response.status = 400
+			return {"ok": False, "msg": f"invalid filter: {e}"}
+	elif ("filter" in query) and not valid_json(query.filter):
+		return {"ok": False, "msg": "invalid JSON provided in 'filter'"}
+
+	if query.at:
+		return scan_at(name, game, query, entity_filter)
+
+	if ("html" in query) and valid_json(query.html) and json.loads(query.html):
+		with GAMES.reading(name):
+			json_entities = game.public_entities(entity_filter)
+		return scan_page(json_entities)
 	elif ("html" in query) and not valid_json(query.html):
 		return {"ok": False, "msg": "invalid JSON provided in 'html'"}
-	else:
-		return {"ok": True, "entities": json_entities}
+
+	# json answers carry the game's version: clients can send it back as since_version to get only
+	# what changed after it, or as If-None-Match (it's also the ETag) to get a 304 if nothing did
+	with GAMES.reading(name):
+		version = game.version_token()
+		if query.since_version:
+			changes = game.entities_since(query.since_version)
+			if changes is not None:
+				changed, removed = changes
+				if entity_filter:
+					changed = [view for view in changed if entity_filter.matches(view)]
+				return {"ok": True, "version": version, "since_version": query.since_version,
+						"entities": changed, "removed": removed}
+			# a version from before the game was (re)loaded: everything may have changed
+
+		etag = f'"{version}"' if entity_filter is None else f'"{version}-{zlib.crc32(query.filter.encode()):08x}"'
+		response.set_header("ETag", etag)
+		if request.get_header("If-None-Match") == etag:
+			response.status = 304
+			return ""
+		if entity_filter is None:
+			# the common case: hand out the cached encoding as is
+			encoded = game.public_entities_json()
+		else:
+			json_entities = game.public_entities(entity_filter)
+
+	if entity_filter is None:
+		response.content_type = "application/json"
+		return '{"ok": true, "version": ' + json.dumps(version) + ', "entities": ' + encoded + '}'
+	return {"ok": True, "version": version, "entities": json_entities}
 
 
 @route("/game/<name>/event_log", method="POST")
@@ -215,28 +399,36 @@ tr:nth-child(even) {
 def summary(name):
 	game = update_to_now(name)
 	query = request.POST
-	print(query.keys())
 
 	query.start, query.end = query.start.strip(), query.end.strip()
 
-	start = datetime.datetime.fromisoformat(query.start) if (
-			query.start and valid_json(query.start)) else datetime.datetime.fromtimestamp(0)  # the epoch
-	end = datetime.datetime.fromisoformat(query.end) if (
-			query.end and valid_datetime(query.end)) else game.get_system_time()
-
-	events = game.get_event_log(start, end)
+	since_event_id = None
+	if query.since_event_id:
+		try:
+			since_event_id = int(query.since_event_id)
+		except ValueError:
+			response.status = 400
+			return {"ok": False, "msg": f"since_event_id must be an integer, but is {query.since_event_id}"}
 
+	event_filter = None
 	if ("filter" in query) and valid_json(query.filter):
-		filters = json.loads(query.filter)
-		print(f"filtering events with filters {filters}")
 		try:
-			events = list(filter(lambda event: all([re.search(filters[k], str(event[k] if k in event.keys() else "")) for k in filters]), events))
-		except Exception as e:
+			event_filter = dotwar_filters.Filter(json.loads(query.filter))
+		except ValueError as e:
 			response.status = 400
-			return {"ok": False, "msg": str("filter values produced error: "+e)}
+			return {"ok": False, "msg": f"filter values produced error: {e}"}
 	elif ("filter" in query) and not valid_json(query.filter):
 		return {"ok": False, "msg": "invalid JSON provided in 'filter'"}
 
+	with GAMES.reading(name):
+		start = datetime.datetime.fromisoformat(query.start) if (
+				query.start and valid_json(query.start)) else datetime.datetime.fromtimestamp(0)  # the epoch
+		end = datetime.datetime.fromisoformat(query.end) if (
+				query.end and valid_datetime(query.end)) else game.get_system_time()
+
+		events = game.get_event_log(start, end, event_filter, since_event_id)
+		last_event_id = game.last_event_id()
+
 	if ("start" in query and "end" in query) and not (valid_datetime(query.start) and valid_datetime(query.end)):
 		return {"ok": False, "msg": "if used, start and end must be ISO datetime strings"}
 	if "html" in query and valid_json(query.html) and json.loads(query.html):
@@ -260,7 +452,8 @@ def summary(name):
 		return "<br/>".join(page)
 
 	else:
-		return {"ok": True, "events": events}
+		# last_event_id is the cursor for the next since_event_id
+		return {"ok": True, "events": events, "last_event_id": last_event_id}
 
 
 @route("/game/<name>/agenda", method="POST")
@@ -281,9 +474,14 @@ def agenda(name):
 	else:
 		return auth
 
+	with GAMES.reading(name):
+		pending = vessel.pending
+		# the game instance is shared between requests, so serialize a copy rather than the live orders
+		json_pending = vessel.get_json_pending()
+
 	if ("html" in query) and valid_json(query.html) and json.loads(query.html):
 		page = [f"<pre>Pending orders for vessel {vessel.name}:"]
-		for order in vessel.pending:
+		for order in pending:
 			page.append("at {}: burn [{:.3f} {:.3f} {:.3f}] ; order ID: {}"
 						.format(order["time"].strftime("%I:%M %p on %A, %b %d, %Y"),
 								*order["args"]["a"], order["order_id"]
@@ -292,14 +490,12 @@ def agenda(name):
 		page = "<br>".join(page)
 		return page
 	else:
-		for order in vessel.pending:
-			order["time"] = order["time"].isoformat()
-		return {"ok": True, "agenda": vessel.pending}
+		return {"ok": True, "agenda": json_pending}
 
 
 @route("/game/<name>/add_order", method="POST")
 def add_order(name):
-	game = dotwar_classes.Game(name, global_config["game_dir"])
+	game = GAMES.get(name)
 	query = request.POST
 
 	if "vessel" not in query:
@@ -317,33 +513,22 @@ def add_order(name):
 
 	if valid_json(query.order):
 		order = json.loads(query.order)
-		print(f"ORDER JSON: {order}")
+		log.debug("game %s: order for %s: %s", name, query.vessel, order)
 	else:
 		return select_err(f"Invalid JSON in order {query.order}", query.html)
 
-	if order["time"] == None:
-		order["time"] = datetime.datetime.now()
-	elif "interval" in order:
-		if order["interval"]:
-			print(f"order time is at an interval of {order['time']} seconds")
-			order["time"] = datetime.datetime.now() + datetime.timedelta(seconds=order["time"])
-			print(f"set order time to {order['time'].isoformat()}")
-		else:
-			return {"ok": False, "msg": f"Invalid interval parameter: {order['interval']} of type {type(order['interval'])}", "input": query.order}
-	elif "time" in order:
-		if valid_datetime(order["time"]):
-			order["time"] = datetime.datetime.fromisoformat(order["time"])
-		else:
-			return {"ok": False, "msg": "Invalid time parameter.", "input": query.order}
-	else:
-		print("NO TIME SPECIFIED IN ORDER, SETTING TO CURRENT TIME")
-		order["time"] = datetime.datetime.now()
-
-	order["args"]["a"] = [(float(e) if (not math.isnan(e) and not math.isinf(e)) else 0) for e in order["args"]["a"]]
+	try:
+		order = prepare_order(order)
+	except ValueError as e:
+		return {"ok": False, "msg": str(e), "input": query.order}
 
-	order_id = vessel.add_order(task=order["task"], args=order["args"], time=order["time"])
-	game.save()
-	update_to_now(name, game)
+	with GAMES.writing(name):
+		if not still_current(name, game, vessel):
+			return select_err(f"Vessel {vessel.name} no longer exists, or game {name} was reloaded: "
+							f"the order wasn't added.", query.html)
+		order_id = vessel.add_order(task=order["task"], args=order["args"], time=order["time"])
+		game.mark_dirty()
+	update_to_now(name)
 
 	if "html" in query and valid_json(query.html) and json.loads(query.html):
 		return f"Order <code>{order['task']} {order['args']} at {order['time']:%I:%M %p on %A, %b %d, %Y}</code> given to vessel {query.vessel} with order ID {order_id}."
@@ -351,6 +536,50 @@ def add_order(name):
 		return {"ok": True, "vessel": query.vessel, "added_id": order_id}
 
 
+@route("/game/<name>/add_orders", method="POST")
+def add_orders(name):
+	# required keys: orders, a JSON list of {"vessel", "authcode", "order"} with order as in add_order.
+	# all of the orders are added, or none of them if any is invalid.
+	game = GAMES.get(name)
+	query = request.POST
+
+	if not valid_json(query.orders) or type(json.loads(query.orders)) is not list:
+		return {"ok": False, "msg": "Please provide a JSON list of orders as 'orders'."}
+	batch = json.loads(query.orders)
+	if len(batch) > MAX_BATCH_ORDERS:
+		response.status = 413
+		return {"ok": False, "msg": f"At most {MAX_BATCH_ORDERS} orders per request, not {len(batch)}."}
+
+	results = []
+	accepted = []  # (vessel, prepared order)
+	for item in batch:
+		try:
+			if type(item) is not dict or type(item.get("vessel")) is not str or type(item.get("authcode")) is not str\
+					or "order" not in item:
+				raise ValueError("Each entry needs 'vessel', 'authcode' and 'order'.")
+			vessel = game.get_authorized_entity(item["vessel"], item["authcode"])
+			accepted.append((vessel, prepare_order(item["order"])))
+			results.append({"ok": True, "vessel": vessel.name})
+		except (LookupError, ValueError, PermissionError) as e:
+			results.append({"ok": False, "vessel": item.get("vessel") if type(item) is dict else None, "msg": str(e)})
+
+	if len(accepted) < len(batch):
+		return {"ok": False, "msg": "No orders were added, as some were invalid.", "results": results}
+
+	with GAMES.writing(name):
+		# a vessel may have been destroyed, or the game reloaded, while we checked the others
+		for vessel, order in accepted:
+			if not still_current(name, game, vessel):
+				return {"ok": False, "msg": f"No orders were added, as vessel {vessel.name} no longer exists "
+											f"or game {name} was reloaded."}
+		for (vessel, order), result in zip(accepted, results):
+			result["added_id"] = vessel.add_order(task=order["task"], args=order["args"], time=order["time"])
+		game.mark_dirty()
+	update_to_now(name)
+
+	return {"ok": True, "results": results}
+
+
 @route("/game/<name>/delete_order", method="POST")
 def delete_order(name):
 	# required keys: vessel, order_id, authcode
@@ -359,8 +588,6 @@ def delete_order(name):
 	game = update_to_now(name)
 	query = request.POST
 
-	print("in delete_order, headers =", dict(query))
-
 	if not ("vessel" in query and "authcode" in query and "order_id" in query):
 		return {"ok": False, "msg": "vessel, order_id, and authcode are required"}
 
@@ -377,13 +604,17 @@ def delete_order(name):
 	else:
 		return auth
 
-	if not vessel.get_order(order_id):
-		return {"ok": False, "msg": f"no pending order #{query.order_id} for vessel {query.vessel}"}
+	with GAMES.writing(name):
+		if not still_current(name, game, vessel):
+			return {"ok": False, "msg": f"Vessel {vessel.name} no longer exists, or game {name} was reloaded: "
+										f"the order wasn't removed."}
+		if not vessel.get_order(order_id):
+			return {"ok": False, "msg": f"no pending order #{query.order_id} for vessel {query.vessel}"}
 
-	# all tests passed:
-	vessel.clear_order(order_id)
-	pending_count = len(vessel.get_pending())
-	game.save()
+		# all tests passed:
+		vessel.clear_order(order_id)
+		pending_count = len(vessel.get_pending())
+		game.mark_dirty()
 
 	if "html" in query and bool(json.loads(query.html)):
 		return {"ok": True, "removed_id": order_id, "pending_count": pending_count}
@@ -391,24 +622,278 @@ def delete_order(name):
 		return f"Removed order with ID {order_id} from vessel {query.vessel}. {pending_count} order(s) pending."
 
 
-# @route("/game/<name>/update_simulation_debug")
-def update_to_now(name=None, game = None):
-	print(GAMES)
-	if not name in GAMES:
-		game = dotwar_classes.Game(name, global_config["game_dir"])
-		GAMES[name] = game
+@route("/game/<name>/preview", method="POST")
+def preview(name):
+	# required keys: vessel, authcode
+	# optional keys: orders (JSON list of hypothetical orders as in add_order), horizon (seconds), samples
+	game = update_to_now(name)
+	query = request.POST
+
+	if "vessel" not in query:
+		return {"ok": False, "msg": "Please provide a spacecraft name as 'vessel' in query string."}
+
+	if "authcode" not in query:
+		return {"ok": False, "msg": "Please provide an authorization code as 'authcode' in query string."}
+
+	auth = try_authorize_vessel(game, query.vessel, query.authcode)
+
+	if type(auth) is dotwar_classes.Entity:
+		vessel = auth
 	else:
-		game = GAMES[name]
-	#game = dotwar_classes.Game(name, global_config["game_dir"]) if not name in GAMES else GAMES[name]
-	old = game.get_system_time()
+		return auth
+
+	orders = []
+	if query.orders:
+		if not valid_json(query.orders) or type(json.loads(query.orders)) is not list:
+			response.status = 400
+			return {"ok": False, "msg": "orders must be a JSON list of orders."}
+		batch = json.loads(query.orders)
+		if len(batch) > MAX_BATCH_ORDERS:
+			response.status = 413
+			return {"ok": False, "msg": f"At most {MAX_BATCH_ORDERS} orders per request, not {len(batch)}."}
+		try:
+			orders = [prepare_order(order) for order in batch]
+		except ValueError as e:
+			response.status = 400
+			return {"ok": False, "msg": str(e)}
+
+	horizon = None
+	samples = PREVIEW_SAMPLES
+	try:
+		if query.horizon:
+			horizon = float(query.horizon)
+			if not 0 < horizon <= MAX_PREVIEW_HORIZON.total_seconds():
+				raise ValueError(f"horizon must be more than 0 and at most {MAX_PREVIEW_HORIZON.total_seconds():g} seconds")
+		if query.samples:
+			samples = int(query.samples)
+			if not 0 < samples <= MAX_PREVIEW_SAMPLES:
+				raise ValueError(f"samples must be from 1 to {MAX_PREVIEW_SAMPLES}")
+	except ValueError as e:
+		response.status = 400
+		return {"ok": False, "msg": str(e)}
+
+	# hypothetical orders given relative to now have a new time on every request, and so miss the cache
+	orders_key = json.dumps([dict(order, time=order["time"].isoformat()) for order in orders], sort_keys=True)
+	with GAMES.reading(name):
+		if game.get_entity(vessel.name) is not vessel:
+			return {"ok": False, "msg": f"Vessel {vessel.name} no longer exists."}
+		key = dotwar_preview.cache_key(game, vessel.name, orders_key, horizon, samples)
+		result = game.previews.get(key, game.get_system_time())
+		fork = game.fork([vessel.name]) if result is None else None
+	cached = result is not None
+	if not cached:
+		# only the fork is simulated, outside the game's lock
+		with dotwar_metrics.span("preview"):
+			result = dotwar_preview.project(fork, vessel.name, orders,
+											datetime.timedelta(seconds=horizon) if horizon is not None else None,
+											samples, MAX_PREVIEW_HORIZON)
+		game.previews.put(key, result)
+	return dict(result, ok=True, vessel=vessel.name, cached=cached)
+
+
+@route("/game/<name>/intercept", method="POST")
+def intercept(name):
+	# required keys: vessel
+	# optional keys: targets (JSON list of entity names), horizon (seconds), authcode and apply
+	game = update_to_now(name)
+	query = request.POST
+
+	if "vessel" not in query:
+		return {"ok": False, "msg": "Please provide a spacecraft name as 'vessel' in query string."}
+
+	targets = None
+	if query.targets:
+		if not valid_json(query.targets) or type(json.loads(query.targets)) is not list\
+				or not all(type(target) is str for target in json.loads(query.targets)):
+			response.status = 400
+			return {"ok": False, "msg": "targets must be a JSON list of entity names."}
+		targets = json.loads(query.targets)
+		if len(targets) > MAX_INTERCEPT_TARGETS:
+			response.status = 413
+			return {"ok": False, "msg": f"At most {MAX_INTERCEPT_TARGETS} targets per request, not {len(targets)}."}
+
+	horizon = MAX_INTERCEPT_HORIZON
+	if query.horizon:
+		try:
+			horizon = datetime.timedelta(seconds=float(query.horizon))
+		except (ValueError, OverflowError):
+			horizon = None
+		if horizon is None or not datetime.timedelta(0) < horizon <= MAX_INTERCEPT_HORIZON:
+			response.status = 400
+			return {"ok": False, "msg": f"horizon must be more than 0 and at most {MAX_INTERCEPT_HORIZON.total_seconds():g} seconds"}
+
+	apply = ("apply" in query) and valid_json(query.apply) and json.loads(query.apply)
+	if apply:
+		# the soonest burn is given to the vessel straight away, as add_order would
+		auth = try_authorize_vessel(game, query.vessel, query.authcode)
+		if type(auth) is not dotwar_classes.Entity:
+			return auth
+
+	lock = GAMES.writing(name) if apply else GAMES.reading(name)
+	with lock:
+		try:
+			results = game.intercepts(query.vessel, targets, horizon)
+		except LookupError as e:
+			response.status = 404
+			return {"ok": False, "msg": str(e)}
+		start = game.get_system_time()
+		reply = {"ok": True, "vessel": query.vessel, "start": start.isoformat(), "intercepts": results}
+		if apply and results and results[0]["reachable"]:
+			reply["added_id"] = game.get_entity(query.vessel).add_order(task="burn", args={"a": results[0]["a"]}, time=start)
+			game.mark_dirty()
+		elif apply:
+			reply["msg"] = "No target can be reached within the horizon, so no order was added."
+	if "added_id" in reply:
+		update_to_now(name)
+	return reply
+
+
+def run_command(game, vessel, command):
+	# carry out one parsed command (see parser.py) for vessel, or for nobody if it's None.
+	# call with the game's write lock held
+	if vessel is not None and not still_current(game.name, game, vessel):
+		return {"ok": False, "msg": f"Vessel {vessel.name} no longer exists, or game {game.name} was reloaded."}
+	if command.verb == "burn":
+		time = command.time(datetime.datetime.now())
+		order_id = vessel.add_order(task="burn", args={"a": command.args}, time=time)
+		game.mark_dirty()
+		return {"ok": True, "added_id": order_id, "time": time.isoformat()}
+	if command.verb == "cancel":
+		order_id = command.args[0]
+		if not vessel.get_order(order_id):
+			return {"ok": False, "msg": f"no pending order #{order_id} for vessel {vessel.name}"}
+		vessel.clear_order(order_id)
+		game.mark_dirty()
+		return {"ok": True, "removed_id": order_id, "pending_count": len(vessel.get_pending())}
+	if command.verb == "agenda":
+		return {"ok": True, "agenda": vessel.get_json_pending()}
+	if command.verb == "scan":
+		return {"ok": True, "entities": game.public_entities()}
+	if command.verb == "summary":
+		return {"ok": True, "events": game.get_event_log(None, None), "last_event_id": game.last_event_id()}
+	return {"ok": False, "msg": f"'{command.verb}' can't be run here."}
+
+
+@route("/game/<name>/command", method="POST")
+def command(name):
+	# required keys: command (text, one command per line) or commands (JSON list of command strings)
+	# optional keys: vessel, authcode (needed by burn, cancel and agenda)
+	game = update_to_now(name)
+	query = request.POST
+
+	lines = [line for line in query.command.splitlines() if line.strip()] if query.command else []
+	if query.commands:
+		if not valid_json(query.commands) or type(json.loads(query.commands)) is not list\
+				or not all(type(line) is str for line in json.loads(query.commands)):
+			response.status = 400
+			return {"ok": False, "msg": "commands must be a JSON list of strings."}
+		lines.extend(json.loads(query.commands))
+	if not lines:
+		return {"ok": False, "msg": "Please provide a command as 'command', or a JSON list of them as 'commands'."}
+	if len(lines) > MAX_BATCH_ORDERS:
+		response.status = 413
+		return {"ok": False, "msg": f"At most {MAX_BATCH_ORDERS} commands per request, not {len(lines)}."}
+
+	vessel = None
+	if query.vessel:
+		auth = try_authorize_vessel(game, query.vessel, query.authcode)
+		if type(auth) is not dotwar_classes.Entity:
+			return auth
+		vessel = auth
+
+	# every command is parsed before any is run: either all of them run, or, if any is invalid, none
+	commands = []
+	results = []
+	for line in lines:
+		try:
+			parsed = PARSER.parse(line)
+			if parsed.signature.needs_vessel and vessel is None:
+				raise parser.ParseError(f"'{parsed.verb}' needs 'vessel' and 'authcode'.")
+			commands.append(parsed)
+			results.append({"ok": True, "command": parsed.text, "verb": parsed.verb})
+		except parser.ParseError as e:
+			results.append({"ok": False, "command": line.strip(), "msg": str(e)})
+	if len(commands) < len(lines):
+		return {"ok": False, "msg": "No commands were run, as some were invalid.", "results": results}
+
+	with GAMES.writing(name):
+		for parsed, result in zip(commands, results):
+			result.update(run_command(game, vessel, parsed))
+	if any(parsed.verb in ("burn", "cancel") for parsed in commands):
+		update_to_now(name)
+	return {"ok": all(result["ok"] for result in results), "results": results}
+
+
+@route("/game/<name>/stream", method=["GET", "POST"])
+def stream(name):
+	# server-sent events; GET as well, since that's all EventSource can do
+	if name not in get_game_list():
+		bottle.response.status = 404
+		return {"ok": False, "msg": f"Couldn't find game {name}."}
+
+	# a reconnecting EventSource sends the id of the last event it got
+	last_event_id = request.get_header("Last-Event-ID") or request.params.get("last_event_id")
+	try:
+		last_event_id = int(last_event_id) if last_event_id else None
+	except ValueError:
+		response.status = 400
+		return {"ok": False, "msg": f"last_event_id must be an integer, but is {last_event_id}"}
+
+	subscriber = STREAMS.subscribe(name)
+	if subscriber is None:
+		response.status = 503
+		response.set_header("Retry-After", "30")
+		return {"ok": False, "msg": f"The server is streaming to as many clients as it can "
+									f"({STREAMS.max_subscribers}), try again later."}
+	response.content_type = "text/event-stream"
+	response.set_header("Cache-Control", "no-cache")
+	return subscriber.messages(last_event_id)
+
+
+# @route("/game/<name>/update_simulation_debug")
+def update_to_now(name):
+	# concurrent requests for the same game share one catch-up (see GameRegistry.catch_up).
+	# a game simulated within the last `freshness` seconds is served as it is, so bursts of requests
+	# reuse one simulated state (and its cached encodings) instead of each advancing it a few milliseconds.
 	now = datetime.datetime.now()
-	print("simulation will be updated from {} to {}, delta of {}".format(old, now, (now - old)), "...")
-	game.update_to(now)
-	new = game.get_system_time()
-	game.save()
-	print("simulation updated to " + new.isoformat() + ",delta of {}".format(new - old))
+	game = GAMES.get(name)
+	if now - game.get_system_time() <= FRESHNESS:
+		return game
+	game = GAMES.catch_up(name, now)
+	log.debug("game %s: simulation updated to %s", name, game.get_system_time().isoformat())
 	return game
 
+
+def _interrupt(signum, frame):
+	raise KeyboardInterrupt
+
+
+def start_warmup():
+	# called by the entrypoints (below, and dotwar_shard's workers) just before they serve, not on import:
+	# importing this module (a WSGI host, the benchmarks) mustn't simulate and save every game in game_dir.
+	# the pool forks while the flusher and ticker are still idle
+	global WARMUP
+	warmup_config = global_config.get("warmup", {})
+	if warmup_config.get("enabled", False) and WARMUP is None:
+		WARMUP = dotwar_registry.WarmUp(GAMES, [name for name in get_game_list() if owns(name)],
+										processes=warmup_config.get("processes"))
+		WARMUP.start()
+
+
+@route("/ready", method=["GET", "POST"])
+def ready():
+	# 200 once the games have been warmed up after startup, 503 until then
+	status = WARMUP.status() if WARMUP is not None else {"ready": True}
+	if not status["ready"]:
+		response.status = 503
+	return {"ok": True, **status}
+
+
+@route("/metrics", method=["GET", "POST"])
+def metrics():
+	# request timings by route, time spent per phase, and simulation work done since startup
+	return {"ok": True, **dotwar_metrics.METRICS.snapshot()}
+
 cors_headers = {
     'Access-Control-Allow-Origin': '*',
     'Access-Control-Allow-Methods': 'GET, POST, PUT, DELETE, OPTIONS',
@@ -423,22 +908,44 @@ def handle_options():
     if request.method == 'OPTIONS':
         # Bypass request routing and immediately return a response
         raise HTTPResponse(headers=cors_headers)
+    name = dotwar_shard.game_of(request.path)
+    if name is not None and not owns(name):
+        # another process has this game loaded, and only it may write its files
+        raise HTTPResponse(json.dumps({"ok": False, "msg": f"Game {name} is served by shard "
+                                       f"{dotwar_shard.shard_of(name, SHARD[1])}, not {SHARD[0]}."}),
+                           status=421, headers={"Content-Type": "application/json", **cors_headers})
+    dotwar_metrics.begin_request()
 
 @hook('after_request')
 def enable_cors():
     for key, value in cors_headers.items():
        response.set_header(key, value)
 
-
-print("[INFO] Detected games:", get_game_list())
-print("[INFO] __name__ at startup:", __name__)
+@hook('after_request')
+def record_timing():
+    route = request.environ.get("bottle.route")
+    timing = dotwar_metrics.end_request(route.rule if route else request.path)
+    if timing is None:
+        return
+    total, phases, counters = timing
+    log.debug("%s %s took %.1f ms %s %s", request.method, request.path, total * 1000, phases, dict(counters))
+    if global_config["debug"]:
+        response.set_header("Server-Timing", dotwar_metrics.server_timing(total, phases, counters))
+
+
+log.info("Detected games: %s", get_game_list())
+log.info("__name__ at startup: %s", __name__)
 application = bottle.default_app()
-print("[INFO] Created default_app")
+log.info("Created default_app")
 
 if __name__ == "__main__":
-	print("[INFO] Starting multithread server on", global_config["server_addr"], global_config["server_port"], "with debug",
-		["disabled", "enabled"][global_config["debug"]] + "...")
+	log.info("Starting multithread server on %s %s with debug %s...", global_config["server_addr"],
+		global_config["server_port"], ["disabled", "enabled"][global_config["debug"]])
+	start_warmup()
+	# bottle stops serving on KeyboardInterrupt and returns, so atexit's final flush runs on SIGTERM too
+	# (kill, systemctl stop) rather than dropping the orders the flusher hasn't saved yet
+	signal.signal(signal.SIGTERM, _interrupt)
 	run(app=application, host=global_config["server_addr"], port=global_config["server_port"],
-		debug=global_config["debug"], server = "cheroot")
+		debug=global_config["debug"], server = "cheroot", numthreads=NUMTHREADS)
 else:
-	print("[INFO] Not in __main__, continuing with default_app only instantiated")
+	log.info("Not in __main__, continuing with default_app only instantiated")
@@ -0,0 +1,304 @@
+# sharded deployment: games spread over worker processes, so one game's long catch-up doesn't stall the others.
+# a game belongs to shard crc32(name) % count for as long as the shard count stays the same, so no two processes
+# ever load, simulate or save the same game.
+#
+#  front process   listens on server_addr:server_port, starts the workers and restarts any that die.
+#                  /game/<name>/... goes to the game's shard, everything else to shard 0, except /metrics
+#                  and /ready, which are gathered from every shard
+#  worker process  the usual dotwar_server application on a unix socket, with DOTWAR_SHARD="<index>/<count>" set.
+#                  it answers 421 for games of other shards, and its ticker only advances its own games
+#
+# config: "shards": {"count": 4, "threads": 16, "socket_dir": null}. threads is per worker, the front has
+# threads * count since every request holds one of its threads while the worker answers.
+#
+# usage: python dotwar_shard.py [--shards N]
+import argparse
+import http.client
+import json
+import logging
+import os
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from urllib.parse import quote
+
+log = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+# headers about the connection itself, which the front's own server sets for its client
+HOP_BY_HOP = {"connection", "keep-alive", "proxy-authenticate", "proxy-authorization", "te", "trailer",
+			"transfer-encoding", "upgrade"}
+
+
+def shard_of(name: str, count: int):
+	# zlib's crc32 rather than hash(), which differs between processes
+	return zlib.crc32(name.encode("utf-8")) % count
+
+
+def game_of(path: str):
+	# name of the game a /game/<name>/... path is about, or None
+	parts = path.split("/")
+	if len(parts) > 2 and parts[1] == "game" and parts[2]:
+		return parts[2]
+	return None
+
+
+def load_config(directory=sys.path[0]):
+	# the front mustn't import dotwar_server, which would set up a registry, flusher and ticker of its own
+	path = os.path.join(directory, "config.json")
+	config = {"server_addr": "localhost", "server_port": 80}
+	if os.path.exists(path):
+		with open(path, "r") as config_file:
+			config.update(json.load(config_file))
+	return config
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+	def __init__(self, socket_path, timeout=None):
+		super().__init__("localhost", timeout=timeout)
+		self.socket_path = socket_path
+
+	def connect(self):
+		self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		self.sock.settimeout(self.timeout)
+		self.sock.connect(self.socket_path)
+
+
+class Shard:
+	def __init__(self, index: int, count: int, socket_path: str, threads: int):
+		self.index = index
+		self.count = count
+		self.socket_path = socket_path
+		self.threads = threads
+		self.process = None
+
+	def start(self):
+		if os.path.exists(self.socket_path):
+			os.remove(self.socket_path)
+		env = dict(os.environ, DOTWAR_SHARD=f"{self.index}/{self.count}")
+		self.process = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--worker", self.socket_path,
+										"--threads", str(self.threads)], env=env)
+		log.info("Started shard %d/%d (pid %d) on %s", self.index, self.count, self.process.pid, self.socket_path)
+
+	def alive(self):
+		return self.process is not None and self.process.poll() is None
+
+	def ready(self):
+		return self.alive() and os.path.exists(self.socket_path)
+
+	def stop(self, timeout=30):
+		if not self.alive():
+			return
+		# SIGTERM lets the worker stop serving and save its games on the way out
+		self.process.terminate()
+		try:
+			self.process.wait(timeout)
+		except subprocess.TimeoutExpired:
+			log.error("Shard %d didn't stop within %d seconds, killing it", self.index, timeout)
+			self.process.kill()
+
+	def connect(self):
+		# no timeout: a catch-up may take long, and streams stay open
+		return UnixHTTPConnection(self.socket_path)
+
+
+class Supervisor(threading.Thread):
+	def __init__(self, count: int, threads=16, socket_dir=None, interval=1.0):
+		super().__init__(name="dotwar-shards", daemon=True)
+		self.socket_dir = socket_dir or tempfile.mkdtemp(prefix="dotwar-shards-")
+		self.owns_socket_dir = socket_dir is None
+		self.shards = [Shard(index, count, os.path.join(self.socket_dir, f"shard.{index}.sock"), threads)
+					for index in range(count)]
+		self.interval = interval
+		self.stopped = threading.Event()
+
+	def shard_for(self, path: str):
+		name = game_of(path)
+		return self.shards[shard_of(name, len(self.shards)) if name is not None else 0]
+
+	def start(self):
+		for shard in self.shards:
+			shard.start()
+		super().start()
+
+	def wait_ready(self, timeout=60):
+		deadline = time.monotonic() + timeout
+		while not all(shard.ready() for shard in self.shards):
+			if time.monotonic() > deadline:
+				return False
+			time.sleep(0.1)
+		return True
+
+	def run(self):
+		while not self.stopped.wait(self.interval):
+			for shard in self.shards:
+				if not shard.alive() and not self.stopped.is_set():
+					log.error("Shard %d exited with %s, restarting it", shard.index, shard.process.returncode)
+					shard.start()
+
+	def stop(self):
+		self.stopped.set()
+		for shard in self.shards:
+			shard.stop()
+		if self.owns_socket_dir:
+			shutil.rmtree(self.socket_dir, ignore_errors=True)
+
+
+def _forward_headers(environ):
+	headers = {key[5:].replace("_", "-").title(): value for key, value in environ.items()
+			if key.startswith("HTTP_") and key[5:].replace("_", "-").lower() not in HOP_BY_HOP}
+	for key, header in (("CONTENT_TYPE", "Content-Type"), ("CONTENT_LENGTH", "Content-Length")):
+		if environ.get(key):
+			headers[header] = environ[key]
+	forwarded_for = headers.get("X-Forwarded-For")
+	client = environ.get("REMOTE_ADDR", "")
+	headers["X-Forwarded-For"] = f"{forwarded_for}, {client}" if forwarded_for else client
+	return headers
+
+
+def _relay(reply, connection):
+	# hand the worker's response on as it arrives: read1 returns whatever is there, so streams aren't held up
+	try:
+		while True:
+			chunk = reply.read1(CHUNK_SIZE)
+			if not chunk:
+				return
+			yield chunk
+	except (http.client.HTTPException, OSError) as e:
+		# the worker went away mid-response, e.g. while a stream was open. the client sees the connection end
+		log.warning("Response from a shard was cut short: %r", e)
+	finally:
+		connection.close()
+
+
+def _json_response(start_response, status, data):
+	body = json.dumps(data).encode("utf-8")
+	start_response(status, [("Content-Type", "application/json"), ("Content-Length", str(len(body)))])
+	return [body]
+
+
+def proxy(shard: Shard, environ, start_response):
+	length = int(environ.get("CONTENT_LENGTH") or 0)
+	body = environ["wsgi.input"].read(length) if length else None
+	# PATH_INFO is the raw path decoded as latin-1, quote it back to what the client sent
+	target = quote(environ.get("PATH_INFO", "/").encode("latin-1"))
+	if environ.get("QUERY_STRING"):
+		target += "?" + environ["QUERY_STRING"]
+
+	connection = shard.connect()
+	try:
+		connection.request(environ["REQUEST_METHOD"], target, body, _forward_headers(environ))
+		reply = connection.getresponse()
+	except OSError as e:
+		connection.close()
+		log.error("Shard %d couldn't be reached: %r", shard.index, e)
+		return _json_response(start_response, "503 Service Unavailable",
+							{"ok": False, "msg": f"Game server shard {shard.index} is unavailable, try again shortly."})
+
+	start_response(f"{reply.status} {reply.reason}",
+				[(key, value) for key, value in reply.getheaders() if key.lower() not in HOP_BY_HOP])
+	return _relay(reply, connection)
+
+
+def gather(supervisor: Supervisor, path: str):
+	# every shard's own answer to path, in shard order
+	shards = []
+	for shard in supervisor.shards:
+		connection = shard.connect()
+		try:
+			connection.request("POST", path)
+			shards.append(json.loads(connection.getresponse().read()))
+		except (OSError, ValueError) as e:
+			shards.append({"ok": False, "msg": f"Game server shard {shard.index} is unavailable: {e!r}"})
+		finally:
+			connection.close()
+	return shards
+
+
+def front_application(supervisor: Supervisor):
+	def application(environ, start_response):
+		# bottle matches routes against the path decoded as utf-8, so do the same
+		path = environ.get("PATH_INFO", "/").encode("latin-1").decode("utf-8", "replace")
+		if path == "/metrics" and environ["REQUEST_METHOD"] in ("GET", "POST"):
+			return _json_response(start_response, "200 OK", {"ok": True, "shards": gather(supervisor, path)})
+		if path == "/ready" and environ["REQUEST_METHOD"] in ("GET", "POST"):
+			# ready once every shard is
+			shards = gather(supervisor, path)
+			ready = all(shard.get("ready", False) for shard in shards)
+			return _json_response(start_response, "200 OK" if ready else "503 Service Unavailable",
+								{"ok": True, "ready": ready, "shards": shards})
+		return proxy(supervisor.shard_for(path), environ, start_response)
+
+	return application
+
+
+def _interrupt(signum, frame):
+	raise KeyboardInterrupt
+
+
+def serve(server):
+	# until SIGTERM or ^C. a worker's atexit handlers then save its games as usual
+	signal.signal(signal.SIGTERM, _interrupt)
+	try:
+		server.start()
+	except KeyboardInterrupt:
+		pass
+	finally:
+		server.stop()
+
+
+def run_worker(socket_path: str, threads: int):
+	from cheroot import wsgi
+
+	import dotwar_server
+
+	dotwar_server.start_warmup()
+	server = wsgi.Server(socket_path, dotwar_server.application, numthreads=threads)
+	dotwar_server.log.info("Shard %s serving on %s", os.environ.get("DOTWAR_SHARD"), socket_path)
+	serve(server)
+
+
+def run_front(config: dict, count: int):
+	from cheroot import wsgi
+
+	shards_config = config.get("shards", {})
+	threads = shards_config.get("threads", 16)
+	supervisor = Supervisor(count, threads=threads, socket_dir=shards_config.get("socket_dir"))
+	supervisor.start()
+	try:
+		if not supervisor.wait_ready():
+			log.warning("Not every shard is up yet, their games answer 503 until they are")
+		server = wsgi.Server((config["server_addr"], config["server_port"]), front_application(supervisor),
+							numthreads=threads * count)
+		log.info("Serving %d shards on %s %s", count, config["server_addr"], config["server_port"])
+		serve(server)
+	finally:
+		supervisor.stop()
+
+
+def main():
+	parser = argparse.ArgumentParser(description="Run a dotwar server with games spread over worker processes.")
+	parser.add_argument("--shards", type=int, help="number of worker processes (default: config shards.count)")
+	parser.add_argument("--worker", metavar="SOCKET", help=argparse.SUPPRESS)
+	parser.add_argument("--threads", type=int, default=16, help=argparse.SUPPRESS)
+	args = parser.parse_args()
+
+	if args.worker:
+		run_worker(args.worker, args.threads)
+		return
+
+	config = load_config()
+	logging.basicConfig(level=config.get("log_level", "INFO"),
+						format="%(asctime)s [%(levelname)s] %(name)s: %(message)s")
+	count = args.shards or config.get("shards", {}).get("count") or os.cpu_count() or 1
+	run_front(config, count)
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,143 @@
+# binary save format for large games.
+# kinematics go in a NumPy .npy file (one row per entity, read in one go and split into columns),
+# everything else in a compact JSON side file with one list per entity attribute instead of one object per entity.
+#
+#  system.<name>.snapshot.json      game header, entity columns, pending orders, event_count, generation
+#  system.<name>.<generation>.npy   KINEMATICS_DTYPE rows, in the same order as the side file's entities
+#
+# each save writes a new .npy under a fresh generation and then replaces the side file, which names it,
+# so a crash mid-save leaves the previous pair intact. the event log file is shared with the JSON format.
+#
+# usage: python dotwar_snapshot.py NAME [--dir DIR] [--to snapshot|json]
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+KINEMATICS_DTYPE = np.dtype([("r", "<f8", (3,)), ("v", "<f8", (3,)), ("a", "<f8", (3,))])
+SIDE_SUFFIX = ".snapshot.json"
+COLUMNS = ("name", "captain", "type", "team", "created_on", "authcode", "captured", "next_order_id")
+
+
+def side_filename(name: str):
+	return f"system.{name}{SIDE_SUFFIX}"
+
+
+def kinematics_filename(name: str, generation: int):
+	return f"system.{name}.{generation}.npy"
+
+
+def kinematics_files(directory: str, name: str):
+	# every generation's kinematics file, current or left over
+	prefix = f"system.{name}."
+	return [file for file in os.listdir(directory) if file.startswith(prefix) and file.endswith(".npy")
+			and file[len(prefix):-len(".npy")].isdigit()]
+
+
+def read(directory: str, name: str):
+	# returns the system in the same shape as a loaded JSON save file, r/v/a as arrays
+	with open(os.path.join(directory, side_filename(name)), "r") as side_file:
+		side = json.load(side_file)
+	columns = side.pop("entities")
+	count = len(columns["name"])
+
+	# read whole: every row is copied into the game's EntityTable straight away, so mapping it would save nothing
+	kinematics = np.load(os.path.join(directory, kinematics_filename(name, side.pop("generation"))))
+	if kinematics.shape != (count,):
+		raise ValueError(f"kinematics file of game {name} has {kinematics.shape[0]} rows, expected {count}")
+	# one contiguous copy per column; entities then take rows of these
+	r, v, a = (np.ascontiguousarray(kinematics[column]) for column in ("r", "v", "a"))
+
+	pending = dict()
+	for order in side.pop("orders"):
+		pending.setdefault(order["parent_entity"], []).append(order)
+
+	entities = []
+	for i, values in enumerate(zip(*(columns[column] for column in COLUMNS))):
+		entity = dict(zip(COLUMNS, values))
+		entity["r"], entity["v"], entity["a"] = r[i], v[i], a[i]
+		entity["pending"] = pending.get(entity["name"], [])
+		# optional attributes are left out, as in the JSON format
+		for optional in ("authcode", "captured"):
+			if entity[optional] is None:
+				del entity[optional]
+		entities.append(entity)
+	side["entities"] = entities
+	return side
+
+
+def write(directory: str, name: str, game: dict, entities: list, orders: list, event_count: int, mode=0o644):
+	# game: the "game" header as JSON. entities: Entity objects. orders: JSON orders of every entity.
+	generation = time.time_ns()
+	kinematics = np.empty(len(entities), dtype=KINEMATICS_DTYPE)
+	if entities:
+		kinematics["r"] = [entity.r for entity in entities]
+		kinematics["v"] = [entity.v for entity in entities]
+		kinematics["a"] = [entity.a for entity in entities]
+
+	side = {
+		"game": game,
+		"generation": generation,
+		"entities": {
+			"name": [entity.name for entity in entities],
+			"captain": [entity.captain for entity in entities],
+			"type": [entity.entity_type for entity in entities],
+			"team": [entity.team for entity in entities],
+			"created_on": [entity.created_on.isoformat() for entity in entities],
+			"authcode": [entity.authcode if type(entity.authcode) is str else None for entity in entities],
+			"captured": [entity.captured if type(entity.captured) is bool else None for entity in entities],
+			"next_order_id": [entity.scheduler.next_ids.get(entity.name, 0) for entity in entities],
+		},
+		"orders": orders,
+		"event_count": event_count,
+	}
+
+	kinematics_path = os.path.join(directory, kinematics_filename(name, generation))
+	side_path = os.path.join(directory, side_filename(name))
+	temp_path = side_path + f".{generation}.tmp"
+	try:
+		with open(kinematics_path, "wb") as kinematics_file:
+			np.save(kinematics_file, kinematics)
+			kinematics_file.flush()
+			os.fsync(kinematics_file.fileno())
+		with open(temp_path, "w") as side_file:
+			side_file.write(json.dumps(side))
+		os.chmod(temp_path, mode)
+		os.replace(temp_path, side_path)
+	except BaseException:
+		for path in (temp_path, kinematics_path):
+			if os.path.exists(path):
+				os.remove(path)
+		raise
+
+	# the side file now points at the new generation
+	for file in kinematics_files(directory, name):
+		if file != kinematics_filename(name, generation):
+			os.remove(os.path.join(directory, file))
+
+
+def remove(directory: str, name: str):
+	for file in kinematics_files(directory, name) + [side_filename(name)]:
+		if os.path.exists(os.path.join(directory, file)):
+			os.remove(os.path.join(directory, file))
+
+
+def main():
+	import dotwar_classes
+
+	parser = argparse.ArgumentParser(description="Convert a dotwar game between the JSON and snapshot save formats.")
+	parser.add_argument("name")
+	parser.add_argument("--dir", default=".", help="game directory")
+	parser.add_argument("--to", default="snapshot", choices=dotwar_classes.Game.STORAGES)
+	args = parser.parse_args()
+
+	game = dotwar_classes.Game(args.name, args.dir)
+	game.set_storage(args.to)
+	game.save()
+	print(f"saved {args.name} as {args.to}: {game.full_path}")
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,187 @@
+import datetime
+import json
+import logging
+import queue
+import threading
+
+log = logging.getLogger(__name__)
+
+
+# live game state as server-sent events, one GameStream per watched game however many clients watch it.
+# messages are encoded once and queued to every subscriber:
+#  event: snapshot    {"system_time", "entities"}: every entity's public view, sent first and after falling behind
+#  event: kinematics  {"system_time", "entities", "removed"}: views that changed since the last one, and destroyed names
+#  event: game_event  one event of the game's log as it is added, with its event_id as the SSE id
+# a comment line goes out every `heartbeat` seconds when there's nothing else, so dropped connections are noticed.
+class Subscriber:
+	def __init__(self, stream, size):
+		self.stream = stream
+		self.queue = queue.Queue(maxsize=size)
+		self.lagging = False  # queue overflowed: what's in it is dropped and a fresh snapshot sent instead
+
+	def put(self, message):
+		try:
+			self.queue.put_nowait(message)
+		except queue.Full:
+			self.lagging = True
+
+	def messages(self, after_event_id=None):
+		# generator of SSE text for the response body. after_event_id: resume after this event (Last-Event-ID)
+		try:
+			for event in self.stream.events_after(after_event_id):
+				yield self.stream.encode_event(event)
+			yield self.stream.snapshot()
+			while True:
+				try:
+					message = self.queue.get(timeout=self.stream.hub.heartbeat)
+				except queue.Empty:
+					yield ": heartbeat\n\n"
+					continue
+				if self.lagging:
+					self.lagging = False
+					while not self.queue.empty():
+						self.queue.get_nowait()
+					message = self.stream.snapshot()
+				yield message
+		finally:
+			self.stream.unsubscribe(self)
+
+
+class GameStream:
+	def __init__(self, hub, name: str):
+		self.hub = hub
+		self.name = name
+		self.subscribers = []
+		self.lock = threading.Lock()  # guards subscribers; never held while the game's lock is taken
+		self.game = None  # the Game instance our listener is attached to
+		self.sent = dict()  # entity name -> public view last broadcast
+		self.stopped = threading.Event()
+		self.thread = threading.Thread(target=self.run, name=f"dotwar-stream-{name}", daemon=True)
+
+	@staticmethod
+	def encode(kind, data, event_id=None):
+		return (f"id: {event_id}\n" if event_id is not None else "") + f"event: {kind}\ndata: {json.dumps(data)}\n\n"
+
+	def encode_event(self, event):
+		return self.encode("game_event", event, event["event_id"])
+
+	def subscribe(self):
+		subscriber = Subscriber(self, self.hub.queue_size)
+		with self.lock:
+			self.subscribers.append(subscriber)
+		return subscriber
+
+	def unsubscribe(self, subscriber):
+		with self.lock:
+			if subscriber in self.subscribers:
+				self.subscribers.remove(subscriber)
+
+	def broadcast(self, message):
+		with self.lock:
+			subscribers = list(self.subscribers)
+		for subscriber in subscribers:
+			subscriber.put(message)
+
+	def on_event(self, event):
+		# called by Game.add_event, inside a simulation update: only queues
+		self.broadcast(self.encode_event(event))
+
+	def attach(self, game):
+		# follow the registry's current instance of the game (it's replaced when reloaded from disk).
+		# the game's listeners are called during updates, so only change them under the game's write lock
+		if game is not self.game:
+			if self.game is not None and self.on_event in self.game.event_listeners:
+				self.game.event_listeners.remove(self.on_event)
+			game.event_listeners.append(self.on_event)
+			self.game = game
+			self.sent = dict()
+
+	def detach(self):
+		if self.game is not None and self.on_event in self.game.event_listeners:
+			self.game.event_listeners.remove(self.on_event)
+		self.game = None
+
+	def events_after(self, event_id):
+		if event_id is None:
+			return []
+		with self.hub.registry.reading(self.name):
+			return list(self.game.system["event_log"][event_id + 1:])
+
+	def snapshot(self):
+		with self.hub.registry.reading(self.name):
+			system_time = self.game.get_system_time().isoformat()
+			encoded = self.game.public_entities_json()
+		return f'event: snapshot\ndata: {{"system_time": {json.dumps(system_time)}, "entities": {encoded}}}\n\n'
+
+	def delta(self):
+		# public views that aren't the ones last broadcast. they're cached per entity version (Entity.public_json),
+		# so an unchanged entity hands back the very same dict
+		with self.hub.registry.reading(self.name):
+			system_time = self.game.get_system_time().isoformat()
+			views = {entity.name: entity.public_json()[0] for entity in self.game.system["entities"].values()}
+		changed = [view for name, view in views.items() if self.sent.get(name) is not view]
+		removed = [name for name in self.sent if name not in views]
+		self.sent = views
+		if not changed and not removed:
+			return None
+		return self.encode("kinematics", {"system_time": system_time, "entities": changed, "removed": removed})
+
+	def run(self):
+		while not self.stopped.wait(self.hub.interval) and not self.hub.retire(self):
+			try:
+				game = self.hub.registry.catch_up(self.name, datetime.datetime.now())
+				if game is not self.game:
+					with self.hub.registry.writing(self.name):
+						self.attach(game)
+				message = self.delta()
+				if message is not None:
+					self.broadcast(message)
+			except Exception as e:
+				log.error("Stream failed to update game %s: %r", self.name, e)
+		self.hub.retire(self, force=True)
+		with self.hub.registry.writing(self.name):
+			self.detach()
+
+
+class StreamHub:
+	def __init__(self, registry, interval=2.0, heartbeat=15.0, queue_size=256, max_subscribers=None):
+		self.registry = registry
+		self.interval = interval  # seconds between kinematics updates
+		self.heartbeat = heartbeat
+		self.queue_size = queue_size  # messages a subscriber may fall behind by before it's resynchronized
+		# open streams across every game, None for no limit. each holds a server thread while it's open
+		self.max_subscribers = max_subscribers
+		self.streams = dict()  # game name -> GameStream
+		self.lock = threading.Lock()
+
+	def subscribe(self, name: str):
+		# a Subscriber, or None if max_subscribers are already watching. never call while holding the game's lock
+		game = self.registry.get(name)
+		with self.lock:
+			if self.max_subscribers is not None and \
+					sum(len(stream.subscribers) for stream in self.streams.values()) >= self.max_subscribers:
+				return None
+			stream = self.streams.get(name)
+			if stream is None:
+				stream = self.streams[name] = GameStream(self, name)
+				stream.thread.start()
+			subscriber = stream.subscribe()
+		with self.registry.writing(name):
+			stream.attach(game)
+		return subscriber
+
+	def retire(self, stream, force=False):
+		# drop the stream if nobody is watching any more (or force), returns whether it was dropped.
+		# checked under both locks, so subscribe() never joins a stream that's about to stop
+		with self.lock, stream.lock:
+			if stream.subscribers and not force:
+				return False
+			if self.streams.get(stream.name) is stream:
+				del self.streams[stream.name]
+			return True
+
+	def stop(self):
+		with self.lock:
+			streams = list(self.streams.values())
+		for stream in streams:
+			stream.stopped.set()
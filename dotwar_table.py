@@ -0,0 +1,97 @@
+import sys
+
+import numpy as np
+
+# columnar storage behind a game's Entity objects (see dotwar_classes.Entity), one row per entity:
+#  r, v, a     (capacity, 3) float arrays
+#  team        int8
+#  kind        int16 code of the entity type, looked up in kinds
+#  captured    int8: -1 for None (not capturable), 0 for False, 1 for True
+# so an entity costs a row in a few shared arrays rather than three small arrays and boxed values of its own.
+#
+# rows of removed entities are handed out again, and the arrays are replaced as the table grows,
+# so keep the Entity (or a copy of a row), not the arrays or a view of a row.
+INITIAL_CAPACITY = 16
+
+
+def captured_code(captured: bool or None):
+	# only booleans are saved (see Entity.as_json), anything else is kept as None
+	return int(captured) if type(captured) is bool else -1
+
+
+def captured_value(code: int):
+	return None if code < 0 else bool(code)
+
+
+class EntityTable:
+	def __init__(self, capacity=INITIAL_CAPACITY):
+		self.capacity = 0
+		self.used = 0  # rows handed out so far, including freed ones
+		self.free = []  # rows of removed entities, to be reused
+		self.kinds = []  # entity type names, by code
+		self.kind_codes = dict()  # entity type name -> code
+		self.r = np.zeros((0, 3), dtype=float)
+		self.v = np.zeros((0, 3), dtype=float)
+		self.a = np.zeros((0, 3), dtype=float)
+		self.team = np.zeros(0, dtype=np.int8)
+		self.kind = np.zeros(0, dtype=np.int16)
+		self.captured = np.zeros(0, dtype=np.int8)
+		self._resize(capacity)
+
+	def __len__(self):
+		return self.used - len(self.free)
+
+	def _resize(self, capacity):
+		for column in ("r", "v", "a", "team", "kind", "captured"):
+			old = getattr(self, column)
+			new = np.zeros((capacity,) + old.shape[1:], dtype=old.dtype)
+			new[:self.used] = old[:self.used]
+			setattr(self, column, new)
+		self.capacity = capacity
+
+	def allocate(self):
+		# a cleared row for a new entity
+		if self.free:
+			row = self.free.pop()
+		else:
+			if self.used == self.capacity:
+				self._resize(max(INITIAL_CAPACITY, self.capacity * 2))
+			row = self.used
+			self.used += 1
+		self.r[row] = self.v[row] = self.a[row] = 0.0
+		self.team[row] = self.kind[row] = 0
+		self.captured[row] = -1
+		return row
+
+	def fill(self, r, v, a, team: int, kind: str, captured: bool or None):
+		# a row for a new entity with these values
+		row = self.allocate()
+		self.r[row] = r
+		self.v[row] = v
+		self.a[row] = a
+		self.team[row] = team
+		self.kind[row] = self.kind_code(kind)
+		self.captured[row] = captured_code(captured)
+		return row
+
+	def copy(self):
+		# an independent table with the same rows, each column copied in one go
+		table = EntityTable.__new__(EntityTable)
+		table.capacity = self.capacity
+		table.used = self.used
+		table.free = list(self.free)
+		table.kinds = list(self.kinds)
+		table.kind_codes = dict(self.kind_codes)
+		for column in ("r", "v", "a", "team", "kind", "captured"):
+			setattr(table, column, getattr(self, column).copy())
+		return table
+
+	def release(self, row: int):
+		self.free.append(row)
+
+	def kind_code(self, kind: str):
+		code = self.kind_codes.get(kind)
+		if code is None:
+			code = self.kind_codes[kind] = len(self.kinds)
+			self.kinds.append(sys.intern(kind))
+		return code
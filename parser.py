@@ -1,135 +1,202 @@
 import datetime
 
+import dotwar_orders
+
+
+# text commands, as described in Myrmidon_Manual.md, e.g. "in 3 hours burn 0 0 0" or "burn 4.04 0 0 at 2022-12-28 17:55".
+# a command is read in one pass over its words: each keyword's reader takes the words it needs from around it,
+# and whatever isn't a keyword or taken by one ("in") is ignored.
+#
+#  verbs      burn x y z, cancel order_id, scan, summary, agenda. exactly one per command
+#  intervals  <number> seconds|minutes|hours|days (and their singulars), added together if there are several
+#  dates      at <year-month-day> <hour:minute[:second]>, or at <year-month-dayThour:minute[:second]>
+# orders (burn) need an interval or a date, other commands ignore them.
+class ParseError(ValueError):
+	pass
+
+
+class Keyword:
+	__slots__ = ("name", "kind", "reader")
+
+	def __init__(self, name: str, kind: str, reader):
+		# kind: "verb", "interval" or "date". reader(tokens, i): (value, indices of the words it used)
+		self.name = name
+		self.kind = kind
+		self.reader = reader
+
+
+class Signature:
+	__slots__ = ("verb", "needs_time", "needs_vessel")
+
+	def __init__(self, verb: str, needs_time=False, needs_vessel=False):
+		self.verb = verb
+		self.needs_time = needs_time
+		self.needs_vessel = needs_vessel  # the command is about the vessel, and needs its authcode
+
+
+class Command:
+	__slots__ = ("text", "verb", "args", "interval", "date", "signature")
+
+	def __init__(self, text: str, verb: str, args: list, interval, date, signature: Signature):
+		self.text = text
+		self.verb = verb
+		self.args = args
+		self.interval = interval  # datetime.timedelta or None
+		self.date = date  # datetime.datetime or None
+		self.signature = signature
+
+	def time(self, now: datetime.datetime):
+		# when an order is to be carried out, counting intervals from now
+		if self.date is not None:
+			return self.date
+		if self.interval is not None:
+			return now + self.interval
+		return now
+
+	def as_json(self):
+		return {"text": self.text, "verb": self.verb, "args": self.args,
+				"interval": self.interval.total_seconds() if self.interval is not None else None,
+				"date": self.date.isoformat() if self.date is not None else None}
+
+
+def _float(word):
+	value = float(word)
+	if value != value or value in (float("inf"), float("-inf")):
+		raise ValueError(word)
+	return value
+
+
+def _word(tokens, i, keyword):
+	if not 0 <= i < len(tokens):
+		raise ParseError(f"'{keyword}' is missing a word {'before' if i < 0 else 'after'} it")
+	return tokens[i]
+
+
+def _number(tokens, i, keyword, convert=float):
+	word = _word(tokens, i, keyword)
+	try:
+		return convert(word)
+	except ValueError:
+		raise ParseError(f"'{keyword}' expected a number, but found '{word}'")
+
+
+def _interval_reader(unit):
+	def read(tokens, i):
+		try:
+			return datetime.timedelta(**{unit: _number(tokens, i - 1, unit, _float)}), (i - 1,)
+		except OverflowError:
+			raise ParseError(f"{tokens[i - 1]} {unit} is too long an interval")
+	return read
+
+
+def _verb_reader(verb, *converters):
+	def read(tokens, i):
+		return [_number(tokens, i + offset, verb, convert) for offset, convert in enumerate(converters, 1)],\
+			tuple(range(i + 1, i + 1 + len(converters)))
+	return read
+
+
+def _read_date(tokens, i):
+	day = _word(tokens, i + 1, "at")
+	used = (i + 1,)
+	if "T" not in day:
+		day = f"{day} {_word(tokens, i + 2, 'at')}"
+		used = (i + 1, i + 2)
+	try:
+		# game times are local: a date with a UTC offset is converted
+		return dotwar_orders.local_time(datetime.datetime.fromisoformat(day)), used
+	except ValueError:
+		raise ParseError(f"'at' expected a date like 2022-12-28 17:55, but found '{day}'")
+
+
+KEYWORDS = {keyword.name: keyword for keyword in (
+	Keyword("seconds", "interval", _interval_reader("seconds")),
+	Keyword("minutes", "interval", _interval_reader("minutes")),
+	Keyword("hours", "interval", _interval_reader("hours")),
+	Keyword("days", "interval", _interval_reader("days")),
+	Keyword("at", "date", _read_date),
+	Keyword("burn", "verb", _verb_reader("burn", _float, _float, _float)),
+	Keyword("cancel", "verb", _verb_reader("cancel", int)),
+	Keyword("scan", "verb", _verb_reader("scan")),
+	Keyword("summary", "verb", _verb_reader("summary")),
+	Keyword("agenda", "verb", _verb_reader("agenda")),
+)}
+ALIASES = {"second": "seconds", "minute": "minutes", "hour": "hours", "day": "days"}
+SIGNATURES = {signature.verb: signature for signature in (
+	Signature("burn", needs_time=True, needs_vessel=True),
+	Signature("cancel", needs_vessel=True),
+	Signature("agenda", needs_vessel=True),
+	Signature("scan"),
+	Signature("summary"),
+)}
+
 
 class Parser:
-	# noinspection PyDefaultArgument
-	def __init__(self,
-	             keywords={
-		             "hours": {-1: float},
-		             "seconds": {-1: float},
-		             "minutes": {-1: float},
-		             "days": {-1: float},
-
-		             "at":{1:str, 2:str},
-
-		             "burn": {1: float, 2: float, 3: float},
-		             "agenda": {},
-		             "scan": {}
-	             },
-	             translations={"hour": "hours"},
-	             time_keywords=["seconds", "hours", "minutes", "days"],
-	             verb_keywords=["burn", "scan", "agenda"],
-	             command_signatures=[{"verb":"VERB_BURN", "required_items":[["INTERVAL", "DATE"]], "required_context":["authcode"]}]
-	             ):
+	def __init__(self, keywords=KEYWORDS, aliases=ALIASES, signatures=SIGNATURES):
+		# the tables are only read, so one Parser can be shared by every request
 		self.keywords = keywords
-		self.translations = translations
-		self.time_keywords = time_keywords
-		self.verb_keywords = verb_keywords
-		self.command_signatures = command_signatures
-
-	def tokenify(self, input_string):
-		tokens = input_string.split()  # example: "in 2 hours burn 0 0 0"
-		# translate tokens to their aliases
-		for i in range(len(tokens)):
-			token = tokens[i]
-			if token in self.translations:
-				tokens[i] = self.translations[token]
-		return tokens
-
-	# detect meaningful tokens and assemble them into 'phrases'
-	# a phrase is a token and the set of other tokens relevant to it
-	def phrasify(self, input_string=None, tokens=None):
-		if tokens is None:
-			tokens = self.tokenify(input_string)
-		phrases = []
-		for i in range(len(tokens)):
-			token = tokens[i]
-			if token in self.keywords:
-				# print("found keyword:", token)
-				# start collecting arguments the keyword specifies
-				arg_indices = self.keywords[token] #expected locations of arguments
-				args = [] # collected arguments
-				for arg_index in arg_indices: #for each expected position
-					arg = tokens[i + int(arg_index)] #collect arg
-					arg_type = arg_indices[arg_index]  # expected type of arg
-					try:
-						arg = arg_type(arg) # convert collected arg string to expected type
-						args.append(arg) # add converted arg to args
-					except ValueError:
-						raise ValueError(
-							"keyword " + token + " expected token of type " + str(arg_type) + " at index " + str(
-								i + int(arg_index)) + " but found '" + arg + "'")
-				phrases.append([token, args])
-		return phrases
-
-	# take phrases and turn them into 'items', replacing input data with python objects as appropriate e.g. timedeltas
-	# an item is something relevant to the top-level parser:
-	# it is a 'verb' (command, action) or 'noun' (data) that is directly relevant to a command.
-	def itemify(self, input_string=None, phrases=None):
-		if phrases is None:
-			phrases = self.phrasify(input_string=input_string)
-		item_types = ["INTERVAL", "DATE", "NAME", "VERB_BURN", "VERB_AGENDA", "VERB_SCAN", "VERB_SUMMARY"]
-		items = []
-		for phrase in phrases:
-			print("testing phrase", phrase)
-			if phrase[0] in self.time_keywords:
-				print("found time phrase:", phrase[0])
-				delta = datetime.timedelta(**{phrase[0]: phrase[1][0]})
-				items.append(["INTERVAL", delta])
-			elif phrase[0] in self.verb_keywords:
-				# print("found verb phrase:", phrase[0])
-				items.append(["VERB_" + phrase[0].upper(), *phrase[1:]])
-			elif phrase[0] == "at":
-				items.append(
-					["DATE",
-					 datetime.datetime.strptime(" ".join(phrase[1]), "%Y-%m-%d %H:%M")]
-				)
-		return items
-
-	# take list of items and determine what command it matches,
-	# classifying it based on verb.
-	# return a representation of the command: a verb and relevant items
-	# i.e {"verb":"burn", "interval":timedelta, "a":[0,0,0], "missing_headers":["authcode", "time"]}
-	# or  {"verb":"burn", "time":datetime, "a":[0,0,0], "missing_headers":["authcode"]}
-	def classify(self, input_string=None, items=None):
-		if items is None:
-			items = self.itemify(input_string=input_string)
-		verb = None
-		signature = None
-		item_labels = [item[0] for item in items]
-		item_contents = [item[1] for item in items]
-		for signature_candidate in self.command_signatures:
-			if signature_candidate["verb"] in item_labels:
-				signature = signature_candidate
-				break
-		verb = signature["verb"]
-
-		for required_item in signature["required_items"]:
-			print("searching in", [e[0] for e in filter(lambda i: (i[0]==required_item or i[0] in required_item), items)])
-			if not [e[0] for e in filter(lambda i: (i[0]==required_item or i[0] in required_item), items)]:
-				raise Exception(f"signature for {verb} expected {required_item}")
-
-		if verb == "VERB_BURN":
-			if "DATE" in item_labels:
-				time = None
-				item = list(filter(lambda i: i[0]=="TIME", items))[0]
-				return {"endpoint":"/add_order",
-				        "headers":{"time":time.isoformat()},
-				        "incomplete_headers":["vessel", "authcode"]
-				        }
-			elif "INTERVAL" in item_labels:
-				return {"endpoint": "/add_order",
-				        "headers": {},
-				        "incomplete_headers": ["vessel", "authcode", "time"],
-				        "context":{}
-				        }
-
-
-
-
-parser_global = Parser()
-input_string_global = input("command vessel> ")
-print("tokens:", parser_global.tokenify(input_string=input_string_global))
-print("phrases:", parser_global.phrasify(input_string=input_string_global))
-print("items:", parser_global.itemify(input_string=input_string_global))
-print("result:", parser_global.classify(input_string=input_string_global))
+		self.aliases = aliases
+		self.signatures = signatures
+
+	def parse(self, text: str):
+		# a Command, or raises ParseError saying what's wrong with text
+		tokens = [self.aliases.get(token, token) for token in text.split()]
+		used = set()  # words read so far, as keywords or as their arguments
+		verb, args, interval, date = None, [], None, None
+		for i, token in enumerate(tokens):
+			keyword = self.keywords.get(token)
+			if keyword is None or i in used:
+				continue
+			value, taken = keyword.reader(tokens, i)
+			# "burn 1 2 3 hours" would otherwise read 3 as both an acceleration and a number of hours
+			shared = sorted(used.intersection(taken))
+			if shared:
+				raise ParseError(f"'{token}' needs {' '.join(repr(tokens[j]) for j in shared)}, "
+								f"but {'that is' if len(shared) == 1 else 'those are'} already part of another phrase")
+			used.update(taken)
+			used.add(i)
+			if keyword.kind == "verb":
+				if verb is not None:
+					raise ParseError(f"a command takes one verb, but found '{verb}' and '{token}'")
+				verb, args = token, value
+			elif keyword.kind == "interval":
+				try:
+					interval = value if interval is None else interval + value
+				except OverflowError:
+					raise ParseError("the intervals add up to too long a time")
+			elif date is not None:
+				raise ParseError("a command takes one date")
+			else:
+				date = value
+
+		if verb is None:
+			raise ParseError(f"no verb in '{text.strip()}', expected one of {', '.join(self.signatures)}")
+		signature = self.signatures[verb]
+		if signature.needs_time:
+			if interval is None and date is None:
+				raise ParseError(f"'{verb}' needs a time: an interval like 'in 3 hours' or a date like 'at 2022-12-28 17:55'")
+			if interval is not None and date is not None:
+				raise ParseError(f"'{verb}' takes an interval or a date, not both")
+		else:
+			interval, date = None, None  # ignored
+		return Command(text.strip(), verb, args, interval, date, signature)
+
+
+def main():
+	# try commands out: python parser.py
+	parser = Parser()
+	while True:
+		try:
+			line = input("command vessel> ")
+		except EOFError:
+			return
+		if not line.strip():
+			continue
+		try:
+			print(parser.parse(line).as_json())
+		except ParseError as e:
+			print("error:", e)
+
+
+if __name__ == "__main__":
+	main()